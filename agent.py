@@ -2,7 +2,7 @@
 
 import asyncio
 import yaml
-from core.loop import AgentLoop
+from core.loop import AgentLoop, drain_index_updates
 from core.session import MultiMCP
 from core.context import MemoryItem, AgentContext
 import datetime
@@ -66,9 +66,22 @@ async def main():
                     break
     except KeyboardInterrupt:
         print("\n👋 Received exit signal. Shutting down...")
+    finally:
+        await drain_index_updates()
+        await multi_mcp.shutdown()
+
+def run_agent():
+    """Run main() on uvloop when it is installed, else on the asyncio loop."""
+    try:
+        # libuv-based event loop: cheaper await/IO dispatch (not available on Windows)
+        import uvloop
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run_agent()
 
 
 #----------- Example queries to test the agent:-----------------
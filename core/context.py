@@ -61,6 +61,7 @@ class AgentContext:
         self.step = 0
         self.task_progress = []  # 🆕 Will track tool executions
         self.final_answer = None
+        self.user_input_override: Optional[str] = None  # set by AgentLoop on FURTHER_PROCESSING_REQUIRED
         
 
         # Log session start
@@ -1,23 +1,27 @@
 # modules/loop.py
 
 import asyncio
+import functools
+import hashlib
 import re
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from core import context
 from modules.perception import run_perception
-from modules.decision import generate_plan
+from modules.decision import generate_plan, uses_historical_examples
 from modules.action import run_python_sandbox
 from modules.model_manager import ModelManager
-from core.session import MultiMCP
 from core.strategy import select_decision_prompt_path
 from core.context import AgentContext
 from modules.tools import summarize_tools
 
 from modules.historical_index import (
-    update_index_for_session,
-    find_best_cached_answer,
+    update_index_for_sessions,
+    QueryCtx,
+    find_best_cached_answer_ctx,
+    get_index_path,
+    load_similar_examples_ctx,
 )
 
 try:
@@ -30,14 +34,142 @@ except ImportError:
         print(f"[{now}] [{stage}] {msg}")
 
 
+# Matches a (possibly async) top-level `def solve(` in a plan
+_SOLVE_RE = re.compile(r"^\s*(?:async\s+)?def\s+solve\s*\(", re.MULTILINE)
+
+_FPR_PREFIX = "FURTHER_PROCESSING_REQUIRED:"
+
 # 🔧 Global verbose toggle (will be set from profiles.yaml at runtime)
 VERBOSE_LOG = False
 
 
-def vlog(stage: str, msg: str) -> None:
-    """Verbose logger: only prints when VERBOSE_LOG is True."""
+# Static body of the finalization prompt; only {q} and {ctx} vary per call.
+_FINALIZE_PROMPT_TMPL = """
+You are a careful but concise assistant.
+
+The user asked:
+{q}
+
+You have the following context from tools (search results, excerpts, or documents).
+It may include URLs, summaries, long snippets, or even messages like "no results found":
+
+{ctx}
+
+Follow this process strictly:
+
+1. Understand what the user is actually asking for.
+
+2. Read the context carefully and look for ANY information that helps answer the question.
+
+3. If the context clearly contains enough information to answer, give a direct,
+   specific answer in 1–2 sentences.
+
+4. If the context is partial but still gives clues, synthesize the best possible
+   answer and mention that it is based on limited information.
+
+5. Only answer exactly "unknown" (or equivalent) if:
+   - The context is truly unrelated or explicitly says no info was found, AND
+   - After reading everything, you find no useful evidence.
+
+Important:
+- Prefer giving a best-effort answer over saying "unknown" whenever the
+  context contains any relevant evidence.
+- Do NOT repeat large chunks of the context. Just state the conclusion.
+- Final output must be ONLY the answer text.
+
+Now, provide your final answer. If long answer multi-paragraph, summarize in one sentence.
+"""
+
+
+# blake2b(question, tool_result) -> finalized answer; shared by all AgentLoop
+# instances in the process, evicted LRU-first.
+_FINALIZE_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_FINALIZE_CACHE_MAX = 256
+
+
+# session_id -> (memory_path, index_path) waiting for a background index
+# update. Requests that arrive while a flush is running (for any session) are
+# queued here and written together in the next batch, so the index is
+# updated once per batch.
+_INDEX_UPDATE_PENDING: Dict[str, Tuple[str, Path]] = {}
+_INDEX_UPDATE_TASK: Optional["asyncio.Task[None]"] = None
+
+
+async def _flush_index_updates() -> None:
+    global _INDEX_UPDATE_TASK
+    try:
+        while _INDEX_UPDATE_PENDING:
+            batches: Dict[Path, List[Tuple[str, str]]] = {}
+            for sid, (memory_path, index_path) in _INDEX_UPDATE_PENDING.items():
+                batches.setdefault(index_path, []).append((memory_path, sid))
+            _INDEX_UPDATE_PENDING.clear()
+            for index_path, pairs in batches.items():
+                try:
+                    await asyncio.to_thread(update_index_for_sessions, pairs, index_path)
+                except Exception as e:
+                    log("history", f"⚠️ Failed to update historical index: {e}")
+    finally:
+        _INDEX_UPDATE_TASK = None
+
+
+async def drain_index_updates() -> None:
+    """Wait for pending background index updates (call before exiting)."""
+    while _INDEX_UPDATE_TASK is not None:
+        await asyncio.gather(_INDEX_UPDATE_TASK, return_exceptions=True)
+
+
+def _truncate_ctx(s: str, head: int = 4000, tail: int = 2000) -> str:
+    """
+    Cap tool output fed to the finalization prompt, keeping the start
+    (usually the best match) and the end (usually the conclusion).
+    """
+    if len(s) <= head + tail:
+        return s
+    return s[:head] + "\n...[truncated]...\n" + s[-tail:]
+
+
+class TaggedResult:
+    """
+    An agent result such as "FINAL_ANSWER: 42", kept as (tag, payload).
+
+    The "TAG: payload" string is only built when str() is called (memory,
+    return value); results parsed from planner/sandbox text keep their
+    original string.
+    """
+
+    __slots__ = ("tag", "payload", "_text")
+
+    FINAL_ANSWER = "FINAL_ANSWER"
+    FURTHER_PROCESSING_REQUIRED = "FURTHER_PROCESSING_REQUIRED"
+
+    def __init__(self, tag: str, payload: str, text: Optional[str] = None):
+        self.tag = tag
+        self.payload = payload
+        self._text = text
+
+    @classmethod
+    def final(cls, payload: Any) -> "TaggedResult":
+        return cls(cls.FINAL_ANSWER, payload)
+
+    @classmethod
+    def from_text(cls, text: str) -> "TaggedResult":
+        """Wrap text that already starts with "TAG:"."""
+        tag, _, payload = text.partition(":")
+        return cls(tag, payload.lstrip(), text)
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = f"{self.tag}: {self.payload}"
+        return self._text
+
+
+def vlog(stage: str, msg: str, *args: Any) -> None:
+    """
+    Verbose logger: only prints when VERBOSE_LOG is True.
+    `msg % args` is only formatted then, so pass large values as args.
+    """
     if VERBOSE_LOG:
-        log(stage, msg)
+        log(stage, msg % args if args else msg)
 
 
 class AgentLoop:
@@ -45,31 +177,41 @@ class AgentLoop:
         self.context = context
         self.mcp = self.context.dispatcher
         self.model = ModelManager()
+        # (effective_user_input, step) -> (perception, examples, selected_tools,
+        # tool_descriptions); reset at the start of every step
+        self._step_cache: Dict[Tuple[str, int], Tuple[Any, Any, List[Any], str]] = {}
+        # the current run's query, prepared once for both index lookups
+        self._query_ctx: Optional[QueryCtx] = None
 
         # ---- Read custom config from profiles.yaml (with safe defaults) ----
         cfg = getattr(self.context.agent_profile, "custom_config", None)
 
         self.verbose_logging = False
         self.jaccard_similarity_threshold = 0.80
-        self.memory_index_file = "memory/historical_conversation_store.json"
+        self.memory_index_file = None
 
         if cfg is not None:
             # profiles.yaml:
             # custom_config:
             #   jaccard_similarity_threshold: 0.85
             #   verbose_logging: true
-            #   memory_index_file: "memory/historical_conversation_store.json"
+            #   memory_index_file: "memory/historical_conversation_store.jsonl"
             self.verbose_logging = getattr(cfg, "verbose_logging", False)
             self.jaccard_similarity_threshold = getattr(
                 cfg, "jaccard_similarity_threshold", 0.85
             )
-            self.memory_index_file = getattr(
-                cfg, "memory_index_file", "memory/historical_conversation_store.json"
-            )
+            self.memory_index_file = getattr(cfg, "memory_index_file", None)
+
+        # Resolved once here and passed to every historical-index call
+        # (falls back to custom_config.memory_index_file / the default store)
+        self.index_path = (
+            Path(self.memory_index_file) if self.memory_index_file else get_index_path()
+        )
+        self.memory_index_file = str(self.index_path)
 
         # Derive memory_root from memory_index_file path
-        # e.g., "memory/historical_conversation_store.json" -> "memory"
-        self.memory_root = str(Path(self.memory_index_file).parent)
+        # e.g., "memory/historical_conversation_store.jsonl" -> "memory"
+        self.memory_root = str(self.index_path.parent)
 
         # set global verbose log flag
         global VERBOSE_LOG
@@ -77,68 +219,105 @@ class AgentLoop:
         # verbose log initial settings
         vlog(
             "initial params",
-            f"Initialized with jaccard_similarity_threshold={self.jaccard_similarity_threshold}, "
-            f"memory_index_file={self.memory_index_file}"
+            "Initialized with jaccard_similarity_threshold=%s, memory_index_file=%s",
+            self.jaccard_similarity_threshold,
+            self.memory_index_file,
         )
 
     def _update_historical_index(self):
         """
-        Incrementally update historical_conversation_store.json
-        for the current session.
-        """
-        try:
-            mm = self.context.memory  # MemoryManager
-            update_index_for_session(mm.memory_path, mm.session_id)
-        except Exception as e:
-            log("history", f"⚠️ Failed to update historical index: {e}")
+        Incrementally update the historical index for the current session.
 
-    async def _finalize_from_content(self, original_question: str, tool_result: str) -> str:
+        Runs in a worker thread as a background task so run() can return
+        without waiting for the index read/merge/write; sessions queued
+        while a flush is running are batched into the next one.
         """
-        Turn raw tool output + user question into a concise final answer.
-
-        This is called when we've hit the FURTHER_PROCESSING_REQUIRED limit.
-        It is fully generic.
+        global _INDEX_UPDATE_TASK
+        mm = self.context.memory  # MemoryManager
+        _INDEX_UPDATE_PENDING[mm.session_id] = (mm.memory_path, self.index_path)
+        if _INDEX_UPDATE_TASK is None:
+            _INDEX_UPDATE_TASK = asyncio.create_task(_flush_index_updates())
+
+    async def _prepare_step(
+        self, effective_user_input: str, step: int, prompt_path: str
+    ) -> Tuple[Any, Any, List[Any], str]:
         """
+        Run perception (+ historical examples lookup in parallel, if the
+        decision prompt uses them) and resolve the selected tools for this step.
 
-        prompt = f"""
-You are a careful but concise assistant.
-
-The user asked:
-{original_question}
-
-You have the following context from tools (search results, excerpts, or documents).
-It may include URLs, summaries, long snippets, or even messages like "no results found":
+        Memoized by (effective_user_input, step): an invalid-plan or failed
+        sandbox retry within the same step only re-runs planning.
+        """
+        key = (effective_user_input, step)
+        cached = self._step_cache.get(key)
+        if cached is not None:
+            vlog("loop", "♻️ Reusing perception for retry.")
+            return cached
+
+        # Same query as the semantic-cache check: reuse its prepared forms
+        query = self._query_ctx
+        if query is None or query.text != effective_user_input:
+            query = QueryCtx.from_query(effective_user_input)
+
+        # Submitted to the executor right away, so the index lookup
+        # overlaps with the perception LLM call.
+        examples_future = None
+        if uses_historical_examples(prompt_path):
+            examples_future = asyncio.get_running_loop().run_in_executor(
+                None,
+                functools.partial(
+                    load_similar_examples_ctx, query, index_path=self.index_path
+                ),
+            )
+        perception = await run_perception(
+            context=self.context,
+            user_input=effective_user_input,
+        )
+        examples = await examples_future if examples_future is not None else None
 
-{tool_result}
+        vlog("perception", "%s", perception)
 
-Follow this process strictly:
+        selected_tools = self.mcp.get_tools_from_servers(perception.selected_servers)
+        tool_descriptions = summarize_tools(selected_tools)
 
-1. Understand what the user is actually asking for.
+        prepared = (perception, examples, selected_tools, tool_descriptions)
+        self._step_cache[key] = prepared
+        return prepared
 
-2. Read the context carefully and look for ANY information that helps answer the question.
-
-3. If the context clearly contains enough information to answer, give a direct,
-   specific answer in 1–2 sentences.
+    def _finish(self, answer: TaggedResult) -> Dict[str, str]:
+        """Record the final answer in session memory + index and build run()'s result."""
+        self.context.final_answer = answer
+        text = str(answer)
+        self.context.memory.add_final_answer(text)
+        self._update_historical_index()
+        return {"status": "done", "result": text}
 
-4. If the context is partial but still gives clues, synthesize the best possible
-   answer and mention that it is based on limited information.
+    async def _finalize_from_content(self, original_question: str, tool_result: str) -> str:
+        """
+        Turn raw tool output + user question into a concise final answer.
 
-5. Only answer exactly "unknown" (or equivalent) if:
-   - The context is truly unrelated or explicitly says no info was found, AND
-   - After reading everything, you find no useful evidence.
+        This is called when we've hit the FURTHER_PROCESSING_REQUIRED limit.
+        It is fully generic.
+        """
 
-Important:
-- Prefer giving a best-effort answer over saying "unknown" whenever the
-  context contains any relevant evidence.
-- Do NOT repeat large chunks of the context. Just state the conclusion.
-- Final output must be ONLY the answer text.
+        ctx = _truncate_ctx(tool_result)
+        key = hashlib.blake2b(
+            f"{original_question}\0{ctx}".encode("utf-8"), digest_size=16
+        ).hexdigest()
+        cached = _FINALIZE_CACHE.get(key)
+        if cached is not None:
+            _FINALIZE_CACHE.move_to_end(key)
+            vlog("loop", "♻️ Finalization served from response cache.")
+            return cached
 
-Now, provide your final answer. If long answer multi-paragraph, summarize in one sentence.
-"""
+        prompt = _FINALIZE_PROMPT_TMPL.format(q=original_question, ctx=ctx)
 
         try:
-            text = await self.model.generate_text(prompt)
-            return text.strip()
+            text = (await self.model.generate_text(prompt)).strip()
+            _FINALIZE_CACHE[key] = text
+            if len(_FINALIZE_CACHE) > _FINALIZE_CACHE_MAX:
+                _FINALIZE_CACHE.popitem(last=False)
+            return text
         except Exception as e:
             log("loop", f"⚠️ Finalization failed: {e}")
             # Fallback: at least return some of the raw tool_result
@@ -154,23 +333,29 @@ Now, provide your final answer. If long answer multi-paragraph, summarize in one
         # ---------------------------------------------------------
         # 0) Try SEMANTIC CACHE first (no perception, no tools)
         # ---------------------------------------------------------
+        # A previous run's index update may still be queued (agent.py goes
+        # straight from run() into a blocking input()); finish it first so a
+        # repeated question can hit the cache.
+        await drain_index_updates()
+
         original_query = self.context.user_input or ""
+        # normalized / tokenized once, shared with the examples lookup
+        self._query_ctx = QueryCtx.from_query(original_query)
 
-        # Use threshold + memory_root from profiles.yaml
-        semantic_hit = find_best_cached_answer(
-            user_query=original_query,
+        # Use threshold from profiles.yaml
+        semantic_hit = find_best_cached_answer_ctx(
+            self._query_ctx,
             min_similarity=self.jaccard_similarity_threshold,
-            memory_root=self.memory_root,
+            index_path=self.index_path,
         )
 
         if semantic_hit:
             log("loop", "🔁 Cache hit – returning stored FINAL_ANSWER (no new history).")
             # semantic_hit already starts with FINAL_ANSWER:
-            self.context.final_answer = semantic_hit.strip()
+            self.context.final_answer = TaggedResult.from_text(semantic_hit.strip())
             # Log into current session memory so this turn is represented
-            # self.context.memory.add_final_answer(self.context.final_answer)
-            # self._update_historical_index()
-            return {"status": "done", "result": self.context.final_answer}
+            # return self._finish(self.context.final_answer)
+            return {"status": "done", "result": str(self.context.final_answer)}
 
         # ---------------------------------------------------------
         # 1) Normal multi-step loop
@@ -181,68 +366,61 @@ Now, provide your final answer. If long answer multi-paragraph, summarize in one
         self.further_processing_uses = 0
 
         for step in range(max_steps):
-            vlog("loop", f"🔁 Step {step+1}/{max_steps} starting...")
+            vlog("loop", "🔁 Step %d/%d starting...", step + 1, max_steps)
             self.context.step = step
+            self._step_cache.clear()
             lifelines_left = self.context.agent_profile.strategy.max_lifelines_per_step
+            prompt_path = select_decision_prompt_path(
+                planning_mode=self.context.agent_profile.strategy.planning_mode,
+                exploration_mode=self.context.agent_profile.strategy.exploration_mode,
+            )
 
             while lifelines_left >= 0:
                 # === Perception ===
-                user_input_override = getattr(self.context, "user_input_override", None)
-                perception = await run_perception(
-                    context=self.context,
-                    user_input=user_input_override or self.context.user_input,
-                )
-
-                vlog("perception", f"{perception}")
+                user_input_override = self.context.user_input_override
+                effective_user_input = user_input_override or self.context.user_input
 
-                selected_servers = perception.selected_servers
-                selected_tools = self.mcp.get_tools_from_servers(selected_servers)
+                (
+                    perception,
+                    examples,
+                    selected_tools,
+                    tool_descriptions,
+                ) = await self._prepare_step(effective_user_input, step, prompt_path)
 
                 # Check if we are currently in a content summarization step (Step 2/3)
                 # This is true if user_input_override is set (i.e., we have content to process).
-                is_summarizing = bool(getattr(self.context, "user_input_override", None))
+                is_summarizing = user_input_override is not None
 
                 # FIX: Only abort if we are NOT summarizing AND no tools were selected.
                 if not selected_tools and not is_summarizing:
                     log("loop", "⚠️ No tools selected — aborting step.")
                     break
 
-
-                effective_user_input = user_input_override or self.context.user_input
-
                 # === Planning ===
-                tool_descriptions = summarize_tools(selected_tools)
-                prompt_path = select_decision_prompt_path(
-                    planning_mode=self.context.agent_profile.strategy.planning_mode,
-                    exploration_mode=self.context.agent_profile.strategy.exploration_mode,
-                )
-
                 plan = await generate_plan(
                     user_input=effective_user_input,
                     perception=perception,
                     memory_items=self.context.memory.get_session_items(),
                     tool_descriptions=tool_descriptions,
+                    examples=examples,
                     prompt_path=prompt_path,
                     step_num=step + 1,
                     max_steps=max_steps,
+                    verbose=VERBOSE_LOG,
                 )
-                vlog("plan", f"{plan}")
+                vlog("plan", "%s", plan)
 
                 # === Execution ===
 
                 # 0) Direct FINAL_ANSWER / FURTHER_PROCESSING from planner (no sandbox)
-                if isinstance(plan, str) and (
-                    plan.startswith("FINAL_ANSWER:")
-                    or plan.startswith("FURTHER_PROCESSING_REQUIRED:")
+                if isinstance(plan, str) and plan.startswith(
+                    ("FINAL_ANSWER:", "FURTHER_PROCESSING_REQUIRED:")
                 ):
                     log("loop", "✅ Planner returned direct answer, skipping sandbox.")
-                    self.context.final_answer = plan
-                    self.context.memory.add_final_answer(self.context.final_answer)
-                    self._update_historical_index()
-                    return {"status": "done", "result": self.context.final_answer}
+                    return self._finish(TaggedResult.from_text(plan))
 
                 # 1) Normal case: LLM returned a solve() function (code plan)
-                if re.search(r"^\s*(async\s+)?def\s+solve\s*\(", plan, re.MULTILINE):
+                if _SOLVE_RE.search(plan):
                     vlog("loop", "[loop] Detected solve() plan — running sandboxed...")
 
                     self.context.log_subtask(tool_name="solve_sandbox", status="pending")
@@ -253,7 +431,6 @@ Now, provide your final answer. If long answer multi-paragraph, summarize in one
                         result = result.strip()
                         if result.startswith("FINAL_ANSWER:"):
                             success = True
-                            self.context.final_answer = result
                             self.context.update_subtask_status("solve_sandbox", "success")
                             self.context.memory.add_tool_output(
                                 tool_name="solve_sandbox",
@@ -262,12 +439,10 @@ Now, provide your final answer. If long answer multi-paragraph, summarize in one
                                 success=True,
                                 tags=["sandbox"],
                             )
-                            self.context.memory.add_final_answer(self.context.final_answer)
-                            self._update_historical_index()
-                            return {"status": "done", "result": self.context.final_answer}
+                            return self._finish(TaggedResult.from_text(result))
 
-                        elif result.startswith("FURTHER_PROCESSING_REQUIRED:"):
-                            content = result.split("FURTHER_PROCESSING_REQUIRED:")[1].strip()
+                        elif (rest := result.removeprefix(_FPR_PREFIX)) is not result:
+                            content = rest.lstrip()
                             self.further_processing_uses += 1
 
                             if self.further_processing_uses <= allowed_fpr_uses:
@@ -286,7 +461,8 @@ Now, provide your final answer. If long answer multi-paragraph, summarize in one
                                 )
                                 vlog(
                                     "loop",
-                                    f"🔁 Continuing based on FURTHER_PROCESSING_REQUIRED — Step {step+1} continues...",
+                                    "🔁 Continuing based on FURTHER_PROCESSING_REQUIRED — Step %d continues...",
+                                    step + 1,
                                 )
                                 break  # go to next step
 
@@ -300,22 +476,16 @@ Now, provide your final answer. If long answer multi-paragraph, summarize in one
                                     original_question=self.context.user_input,
                                     tool_result=content,
                                 )
-                                self.context.final_answer = f"FINAL_ANSWER: {final_answer}"
-                                self.context.memory.add_final_answer(self.context.final_answer)
-                                self._update_historical_index()
-                                return {
-                                    "status": "done",
-                                    "result": self.context.final_answer,
-                                }
+                                return self._finish(TaggedResult.final(final_answer))
 
                         elif result.startswith("[sandbox error:"):
                             success = False
-                            self.context.final_answer = "FINAL_ANSWER: [Execution failed]"
+                            self.context.final_answer = TaggedResult.final("[Execution failed]")
                         else:
                             success = True
-                            self.context.final_answer = f"FINAL_ANSWER: {result}"
+                            self.context.final_answer = TaggedResult.final(result)
                     else:
-                        self.context.final_answer = f"FINAL_ANSWER: {result}"
+                        self.context.final_answer = TaggedResult.final(result)
 
                     if success:
                         self.context.update_subtask_status("solve_sandbox", "success")
@@ -331,23 +501,19 @@ Now, provide your final answer. If long answer multi-paragraph, summarize in one
                     )
 
                     if success and "FURTHER_PROCESSING_REQUIRED:" not in result:
-                        self.context.memory.add_final_answer(self.context.final_answer)
-                        self._update_historical_index()
-                        return {"status": "done", "result": self.context.final_answer}
+                        return self._finish(self.context.final_answer)
                     else:
                         lifelines_left -= 1
-                        vlog("loop", f"🛠 Retrying... Lifelines left: {lifelines_left}")
+                        vlog("loop", "🛠 Retrying... Lifelines left: %d", lifelines_left)
                         continue
                 else:
                     vlog(
                         "loop",
-                        f"⚠️ Invalid plan detected — retrying... Lifelines left: {lifelines_left-1}",
+                        "⚠️ Invalid plan detected — retrying... Lifelines left: %d",
+                        lifelines_left - 1,
                     )
                     lifelines_left -= 1
                     continue
 
         log("loop", "⚠️ Max steps reached without finding final answer.")
-        self.context.final_answer = "FINAL_ANSWER: [Max steps reached]"
-        self.context.memory.add_final_answer(self.context.final_answer)
-        self._update_historical_index()
-        return {"status": "done", "result": self.context.final_answer}
+        return self._finish(TaggedResult.final("[Max steps reached]"))
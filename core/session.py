@@ -1,10 +1,24 @@
 # core/session.py
 
+import asyncio
 import os
 import sys
+import time
 from typing import Optional, Any, List, Dict
+import anyio
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+
+# Raised by a session whose server process died or closed its pipes
+_TRANSPORT_ERRORS = (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream)
+
+
+def _is_transport_error(e: BaseException) -> bool:
+    if isinstance(e, _TRANSPORT_ERRORS):
+        return True
+    return isinstance(e, McpError) and e.error.code == CONNECTION_CLOSED
 
 
 class MCP:
@@ -48,48 +62,158 @@ class MCP:
                 return await session.call_tool(tool_name, arguments=arguments)
 
 
+class ServerConnection:
+    """
+    Long-lived stdio session to a single MCP server.
+
+    The stdio_client / ClientSession context managers are entered and exited
+    by one owner task (anyio requires that), while callers from any task share
+    the live session. The server process is started on first use, closed after
+    `idle_timeout` seconds without calls, and restarted on demand.
+    """
+
+    def __init__(self, config: dict, idle_timeout: float = 300.0):
+        self.config = config
+        self.idle_timeout = idle_timeout
+        self._session: Optional[ClientSession] = None
+        self._owner: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._inflight = 0
+        self._last_used = 0.0
+        self._error: Optional[BaseException] = None
+
+    async def _run(self):
+        params = StdioServerParameters(
+            command=sys.executable,
+            args=[self.config["script"]],
+            cwd=self.config.get("cwd", os.getcwd())
+        )
+        try:
+            async with stdio_client(params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    self._session = session
+                    self._last_used = time.monotonic()
+                    self._ready.set()
+
+                    while not self._stop.is_set():
+                        try:
+                            await asyncio.wait_for(self._stop.wait(), timeout=self.idle_timeout)
+                        except asyncio.TimeoutError:
+                            idle = time.monotonic() - self._last_used
+                            if self._inflight == 0 and idle >= self.idle_timeout:
+                                break
+                    # No new callers may pick up the session while it closes
+                    self._session = None
+        except Exception as e:
+            self._error = e
+        finally:
+            self._session = None
+            self._ready.set()  # unblock a waiting _acquire() if startup failed
+
+    async def _acquire(self) -> ClientSession:
+        async with self._lock:
+            if self._session is None:
+                if self._owner is not None:
+                    # Let a session that is shutting down finish closing first
+                    self._stop.set()
+                    await asyncio.gather(self._owner, return_exceptions=True)
+                self._ready = asyncio.Event()
+                self._stop = asyncio.Event()
+                self._error = None
+                self._owner = asyncio.create_task(self._run())
+                await self._ready.wait()
+                if self._session is None:
+                    raise RuntimeError(
+                        f"Could not start MCP server {self.config['script']}: {self._error}"
+                    )
+            self._inflight += 1
+            return self._session
+
+    def _release(self):
+        self._inflight -= 1
+        self._last_used = time.monotonic()
+
+    def _discard(self, session: ClientSession):
+        """
+        Drop a session whose transport broke (e.g. the server process died):
+        the owner task is told to exit, and the next _acquire() starts a
+        fresh server instead of handing out the dead session again.
+        """
+        if self._session is session:
+            self._session = None
+            self._stop.set()
+
+    async def list_tools(self) -> List[Any]:
+        session = await self._acquire()
+        try:
+            return (await session.list_tools()).tools
+        except Exception as e:
+            if _is_transport_error(e):
+                self._discard(session)
+            raise
+        finally:
+            self._release()
+
+    async def call_tool(self, tool_name: str, arguments: dict) -> Any:
+        session = await self._acquire()
+        try:
+            return await session.call_tool(tool_name, arguments)
+        except Exception as e:
+            if _is_transport_error(e):
+                self._discard(session)
+            raise
+        finally:
+            self._release()
+
+    async def close(self):
+        if self._owner is not None:
+            self._stop.set()
+            await asyncio.gather(self._owner, return_exceptions=True)
+            self._owner = None
+
+
 class MultiMCP:
     """
-    Stateless version: discovers tools from multiple MCP servers, but reconnects per tool call.
-    Each call_tool() uses a fresh session based on tool-to-server mapping.
+    Discovers tools from multiple MCP servers and routes call_tool() by
+    tool-to-server mapping. Keeps one ServerConnection per server so repeated
+    tool calls reuse the running server process instead of spawning a new
+    one per call; idle servers are closed after `idle_timeout` seconds.
     """
 
-    def __init__(self, server_configs: List[dict]):
+    def __init__(self, server_configs: List[dict], idle_timeout: float = 300.0):
         self.server_configs = server_configs
+        self.idle_timeout = idle_timeout
         self.tool_map: Dict[str, Dict[str, Any]] = {}  # tool_name → {config, tool}
         self.server_tools: Dict[str, List[Any]] = {}  # server_name -> list of tools
+        self.connections: Dict[str, ServerConnection] = {}  # server_name -> live connection
 
+    def _connection_for(self, config: dict) -> ServerConnection:
+        server_key = config["id"]
+        conn = self.connections.get(server_key)
+        if conn is None:
+            conn = ServerConnection(config, idle_timeout=self.idle_timeout)
+            self.connections[server_key] = conn
+        return conn
 
     async def initialize(self):
         print("in MultiMCP initialize")
         for config in self.server_configs:
             try:
-                params = StdioServerParameters(
-                    command=sys.executable,
-                    args=[config["script"]],
-                    cwd=config.get("cwd", os.getcwd())
-                )
-                print(f"→ Scanning tools from: {config['script']} in {params.cwd}")
-                async with stdio_client(params) as (read, write):
-                    print("Connection established, creating session...")
-                    try:
-                        async with ClientSession(read, write) as session:
-                            print("[agent] Session created, initializing...")
-                            await session.initialize()
-                            print("[agent] MCP session initialized")
-                            tools = await session.list_tools()
-                            print(f"→ Tools received: {[tool.name for tool in tools.tools]}")
-                            for tool in tools.tools:
-                                self.tool_map[tool.name] = {
-                                    "config": config,
-                                    "tool": tool
-                                }
-                                server_key = config["id"]  # fallback to script name if no key
-                                if server_key not in self.server_tools:
-                                    self.server_tools[server_key] = []
-                                self.server_tools[server_key].append(tool)
-                    except Exception as se:
-                        print(f"❌ Session error: {se}")
+                print(f"→ Scanning tools from: {config['script']} in {config.get('cwd', os.getcwd())}")
+                tools = await self._connection_for(config).list_tools()
+                print(f"→ Tools received: {[tool.name for tool in tools]}")
+                for tool in tools:
+                    self.tool_map[tool.name] = {
+                        "config": config,
+                        "tool": tool
+                    }
+                    server_key = config["id"]  # fallback to script name if no key
+                    if server_key not in self.server_tools:
+                        self.server_tools[server_key] = []
+                    self.server_tools[server_key].append(tool)
             except Exception as e:
                 print(f"❌ Error initializing MCP server {config['script']}: {e}")
 
@@ -98,17 +222,7 @@ class MultiMCP:
         if not entry:
             raise ValueError(f"Tool '{tool_name}' not found on any server.")
 
-        config = entry["config"]
-        params = StdioServerParameters(
-            command=sys.executable,
-            args=[config["script"]],
-            cwd=config.get("cwd", os.getcwd())
-        )
-
-        async with stdio_client(params) as (read, write):
-            async with ClientSession(read, write) as session:
-                await session.initialize()
-                return await session.call_tool(tool_name, arguments)
+        return await self._connection_for(entry["config"]).call_tool(tool_name, arguments)
 
     async def list_all_tools(self) -> List[str]:
         return list(self.tool_map.keys())
@@ -126,4 +240,6 @@ class MultiMCP:
 
 
     async def shutdown(self):
-        pass  # no persistent sessions to close
\ No newline at end of file
+        for conn in self.connections.values():
+            await conn.close()
+        self.connections.clear()
\ No newline at end of file
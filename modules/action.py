@@ -24,6 +24,22 @@ class ToolCallResult(BaseModel):
 
 MAX_TOOL_CALLS_PER_PLAN = 5
 
+
+class SandboxMCP:
+    """Tool-call proxy exposed to solve() as `mcp`, with a per-plan call budget."""
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.call_count = 0
+
+    async def call_tool(self, tool_name: str, input_dict: dict):
+        self.call_count += 1
+        if self.call_count > MAX_TOOL_CALLS_PER_PLAN:
+            raise RuntimeError(f"Exceeded max tool calls ({MAX_TOOL_CALLS_PER_PLAN}) in solve() plan.")
+        # REAL tool call now (reuses the dispatcher's live server connection)
+        result = await self.dispatcher.call_tool(tool_name, input_dict)
+        return result
+
 async def run_python_sandbox(code: str, dispatcher: Any) -> str:
     print("[action] 🔍 Entered run_python_sandbox()")
 
@@ -32,19 +48,6 @@ async def run_python_sandbox(code: str, dispatcher: Any) -> str:
 
     try:
         # Patch MCP client with real dispatcher
-        class SandboxMCP:
-            def __init__(self, dispatcher):
-                self.dispatcher = dispatcher
-                self.call_count = 0
-
-            async def call_tool(self, tool_name: str, input_dict: dict):
-                self.call_count += 1
-                if self.call_count > MAX_TOOL_CALLS_PER_PLAN:
-                    raise RuntimeError(f"Exceeded max tool calls ({MAX_TOOL_CALLS_PER_PLAN}) in solve() plan.")
-                # REAL tool call now
-                result = await self.dispatcher.call_tool(tool_name, input_dict)
-                return result
-
         sandbox.mcp = SandboxMCP(dispatcher)
 
         # Preload safe built-ins into the sandbox
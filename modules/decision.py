@@ -1,11 +1,14 @@
-from typing import List, Optional
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
 from modules.perception import PerceptionResult
 from modules.memory import MemoryItem
 from modules.model_manager import ModelManager
 from modules.tools import load_prompt
 import re
+import asyncio
+import hashlib
 
-from modules.historical_index import load_similar_examples
+from modules.historical_index import load_similar_examples, _should_index_final_answer
 
 # Optional logging fallback
 try:
@@ -18,6 +21,76 @@ except ImportError:
 
 model = ModelManager()
 
+# blake2b(user_input, prompt_path, tool_descriptions) -> direct FINAL_ANSWER
+# the planner returned for it; evicted LRU-first.
+_PLAN_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_PLAN_CACHE_MAX = 4096
+
+# Applied only to lines that already start with "def" / "async"
+_SOLVE_LINE_RE = re.compile(r"(?:async\s+)?def\s+solve\s*\(")
+
+
+
+def _plan_cache_key(user_input: str, prompt_path: str, tool_descriptions: Optional[str]) -> str:
+    return hashlib.blake2b(
+        f"{user_input}\0{prompt_path}\0{tool_descriptions or ''}".encode("utf-8"),
+        digest_size=16,
+    ).hexdigest()
+
+
+def _exact_match_answer(user_input: str, examples: List[Dict[str, Any]]) -> Optional[str]:
+    """
+    FINAL_ANSWER of a historical example whose query is exactly this
+    input (case/whitespace-insensitive), if any.
+    """
+    q = user_input.strip().lower()
+    for ex in examples:
+        fa = ex.get("final_answer") or ""
+        if (ex.get("user_query") or "").strip().lower() == q and fa.startswith("FINAL_ANSWER:"):
+            return fa
+    return None
+
+
+def _versioned_pack(body: str) -> str:
+    """
+    Prefix a dynamic prompt block with a short content hash, so identical
+    packs render byte-identical and a changed pack is easy to spot in logs.
+    """
+    version = hashlib.blake2b(body.encode("utf-8"), digest_size=4).hexdigest()
+    return f"# memory-pack v={version}\n{body}"
+
+
+def _build_examples_pack(examples: List[Dict[str, Any]]) -> str:
+    """
+    Render historical examples in a stable (session_id, turn_index) order,
+    independent of the order the similarity ranking returned them in.
+    """
+    lines = []
+    for ex in sorted(examples, key=lambda e: (str(e.get("session_id")), e.get("turn_index") or 0)):
+        fa = ex.get("final_answer") or ""
+        if len(fa) > 500:
+            fa = fa[:500] + "... [truncated]"
+        lines.append(
+            f"- Past query: {ex['user_query']}\n"
+            f"  Tools: {', '.join(ex['tools_used'])}\n"
+            f"  Outcome: {fa}"
+        )
+    return _versioned_pack("\n".join(lines))
+
+
+def _load_decision_prompt(path: str) -> Tuple[str, bool, bool]:
+    """
+    Prompt template plus whether it uses {memory_texts} / {historical_examples}
+    (the template text is cached by load_prompt).
+    """
+    template = load_prompt(path)
+    return template, "{memory_texts}" in template, "{historical_examples}" in template
+
+
+def uses_historical_examples(prompt_path: str) -> bool:
+    """Whether the decision template has a {historical_examples} placeholder."""
+    return _load_decision_prompt(prompt_path)[2]
+
 
 async def generate_plan(
     user_input: str,
@@ -27,47 +100,61 @@ async def generate_plan(
     prompt_path: str,
     step_num: int = 1,
     max_steps: int = 3,
+    examples: Optional[List[Dict[str, Any]]] = None,
+    verbose: bool = False,
 ) -> str:
-    """Generates the full solve() function plan for the agent."""
-
-    # Session-local memory (optional)
-    memory_texts = "\n".join(f"- {m.text}" for m in memory_items) or "None"
-
-    # 1) Try direct reuse from historical memory
-    examples = load_similar_examples(user_input)
-
+    """
+    Generates the full solve() function plan for the agent.
+
+    `examples` may be pre-fetched by the caller (see AgentLoop.run);
+    otherwise similar historical examples are looked up here, but only if
+    the template has a {historical_examples} placeholder.
+    Session memory is only joined from `memory_items` if the prompt
+    template has a {memory_texts} placeholder.
+    `verbose` (AgentLoop's VERBOSE_LOG) enables logging the prompt snippet.
+    """
+
+    # Template (+ historical examples, unless pre-fetched or unused) loaded
+    # off the event loop
+    prompt_template, uses_memory_texts, uses_historical_examples = await asyncio.to_thread(
+        _load_decision_prompt, prompt_path
+    )
+    if examples is None and uses_historical_examples:
+        examples = await asyncio.to_thread(load_similar_examples, user_input)
+
+    # Exact repeat of a solved query: no LLM call
+    plan_key = _plan_cache_key(user_input, prompt_path, tool_descriptions)
+    cached = _PLAN_CACHE.get(plan_key)
+    if cached is not None:
+        _PLAN_CACHE.move_to_end(plan_key)
+        log("plan", f"Using cached FINAL_ANSWER for exact repeat: {cached}")
+        return cached
     if examples:
-        lines = []
-        for ex in examples:
-            fa = ex.get("final_answer") or ""
-            if len(fa) > 500:
-                fa = fa[:500] + "... [truncated]"
-            lines.append(
-                f"- Past query: {ex['user_query']}\n"
-                f"  Tools: {', '.join(ex['tools_used'])}\n"
-                f"  Outcome: {fa}"
-            )
-        historical_examples = "\n".join(lines)
-    else:
-        historical_examples = "None available"
-
-    prompt_template = load_prompt(prompt_path)
+        exact = _exact_match_answer(user_input, examples)
+        if exact:
+            log("plan", f"Using FINAL_ANSWER of identical past query: {exact}")
+            return exact
 
     # Format kwargs guarded by placeholder checks
     format_kwargs = {
         "tool_descriptions": tool_descriptions,
         "user_input": user_input
     }
-    if "{memory_texts}" in prompt_template:
-        format_kwargs["memory_texts"] = memory_texts
+    if uses_memory_texts:
+        # Session-local memory (optional)
+        memory_texts = "\n".join(f"- {m.text}" for m in memory_items)
+        format_kwargs["memory_texts"] = memory_texts or "None"
 
-    if "{historical_examples}" in prompt_template:
-        format_kwargs["historical_examples"] = historical_examples
+    if uses_historical_examples:
+        format_kwargs["historical_examples"] = (
+            _build_examples_pack(examples) if examples else "None available"
+        )
 
     prompt = prompt_template.format(**format_kwargs)
 
-    snippet = prompt[:2500]# .replace("\n", " ")
-    log("plan", f"Prompt snippet: {snippet}...")
+    if verbose:
+        snippet = prompt[:2500]# .replace("\n", " ")
+        log("plan", f"Prompt snippet: {snippet}...")
 
     try:
         raw = (await model.generate_text(prompt)).strip()
@@ -86,17 +173,33 @@ async def generate_plan(
         #    anywhere in the output AND there is NO solve(),
         #    treat that as the planner giving us a direct answer.
         # ----------------------------------------------------
-        has_solve = bool(re.search(r"^\s*(async\s+)?def\s+solve\s*\(", raw, re.MULTILINE))
+        has_solve = False
+        direct_final = direct_fpr = None
+        for line in raw.split("\n"):
+            s = line.lstrip()
+            if s.startswith(("def", "async")):
+                if _SOLVE_LINE_RE.match(s):
+                    has_solve = True
+                    break  # a plan: direct answers are ignored
+            elif s.startswith("FINAL_ANSWER:"):
+                if direct_final is None:
+                    direct_final = s
+            elif s.startswith("FURTHER_PROCESSING_REQUIRED:"):
+                if direct_fpr is None:
+                    direct_fpr = s
 
-        direct_final = re.search(r"^\s*(FINAL_ANSWER:.*)$", raw, re.MULTILINE)
         if direct_final and not has_solve:
-            answer = direct_final.group(1).strip()
+            answer = direct_final.strip()
             log("plan", f"Using direct FINAL_ANSWER from planner: {answer}")
+            # same junk filter as the historical index ("unknown", ...)
+            if _should_index_final_answer(answer):
+                _PLAN_CACHE[plan_key] = answer
+                if len(_PLAN_CACHE) > _PLAN_CACHE_MAX:
+                    _PLAN_CACHE.popitem(last=False)
             return answer
 
-        direct_fpr = re.search(r"^\s*(FURTHER_PROCESSING_REQUIRED:.*)$", raw, re.MULTILINE)
         if direct_fpr and not has_solve:
-            answer = direct_fpr.group(1).strip()
+            answer = direct_fpr.strip()
             log("plan", f"Using direct FURTHER_PROCESSING_REQUIRED from planner: {answer}")
             return answer
 
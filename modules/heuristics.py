@@ -1,6 +1,12 @@
 from typing import Optional
 import re
 
+try:
+    # Optional: pyahocorasick for single-pass multi-word masking
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
 class HeuristicResult:
     def __init__(self, allowed: bool, text: str, reason: Optional[str] = None):
         self.allowed = allowed
@@ -10,6 +16,61 @@ class HeuristicResult:
 BANNED_WORDS = {"badword1", "badword2"}
 BLOCKED_DOMAINS = {"gmail.com", "drive.google.com", "localhost"}
 
+# Checks 3-5 of apply_query_heuristics, precompiled, in priority order (first
+# wins). Each rule searches on its own: in one combined alternation an earlier
+# match could consume an overlapping higher-priority one.
+_QUERY_BLOCK_RULES = (
+    (
+        re.compile("|".join(re.escape(d) for d in BLOCKED_DOMAINS)),
+        "FINAL_ANSWER: For privacy reasons I can’t access that site. Please paste the relevant text instead.",
+    ),
+    (
+        re.compile(r"rm -rf|powershell|bypass antivirus", re.IGNORECASE),
+        "FINAL_ANSWER: I can’t help with harmful or unsafe scripts.",
+    ),
+    (
+        re.compile(r"password|secret key|confidential", re.IGNORECASE),
+        "FINAL_ANSWER: This looks confidential. Please remove secrets and try again.",
+    ),
+)
+# All banned words in one alternation: a single pass over the answer
+_BANNED_RE = re.compile("|".join(re.escape(w) for w in BANNED_WORDS), re.IGNORECASE)
+# casefolded words for the cheap substring probe, and the longest word length
+_BANNED_FOLDED = tuple(w.casefold() for w in BANNED_WORDS)
+_BANNED_MAX_LEN = max(map(len, BANNED_WORDS), default=0)
+
+
+def _build_banned_automaton():
+    if ahocorasick is None or not BANNED_WORDS:
+        return None
+    automaton = ahocorasick.Automaton()
+    for w in BANNED_WORDS:
+        automaton.add_word(w.lower(), len(w))
+    automaton.make_automaton()
+    return automaton
+
+
+_BANNED_AUTOMATON = _build_banned_automaton()
+
+
+def _mask_banned_words(answer: str) -> str:
+    """Replace every (case-insensitive) banned word with asterisks."""
+    # Common case: no banned word at all -> plain C-level substring checks
+    folded = answer.casefold()
+    if not any(w in folded for w in _BANNED_FOLDED):
+        return answer
+    if _BANNED_AUTOMATON is not None:
+        low = answer.lower()
+        # offsets in the lowered text only line up if lower() kept the length
+        if len(low) == len(answer):
+            chars = None
+            for end, n in _BANNED_AUTOMATON.iter(low):
+                if chars is None:
+                    chars = list(answer)
+                chars[end - n + 1:end + 1] = "*" * n
+            return answer if chars is None else "".join(chars)
+    return _BANNED_RE.sub(lambda m: "*" * len(m.group(0)), answer)
+
 def apply_query_heuristics(user_input: str) -> HeuristicResult:
     text = user_input.strip()
 
@@ -21,28 +82,20 @@ def apply_query_heuristics(user_input: str) -> HeuristicResult:
     if len(text) > 3000:
         return HeuristicResult(False, "FINAL_ANSWER: Your request is quite long. Please narrow it down.")
 
-    # 3) blocked domains
+    # 3) blocked domains, 4) harmful scripts, 5) confidential patterns
     # (simple example)
-    for domain in BLOCKED_DOMAINS:
-        if domain in text:
-            return HeuristicResult(False, "FINAL_ANSWER: For privacy reasons I can’t access that site. Please paste the relevant text instead.")
-
-    # 4) harmful scripts
-    if re.search(r"rm -rf|powershell|bypass antivirus", text, re.IGNORECASE):
-        return HeuristicResult(False, "FINAL_ANSWER: I can’t help with harmful or unsafe scripts.")
-
-    # 5) confidential patterns
-    if re.search(r"(password|secret key|confidential)", text, re.IGNORECASE):
-        return HeuristicResult(False, "FINAL_ANSWER: This looks confidential. Please remove secrets and try again.")
+    for pattern, message in _QUERY_BLOCK_RULES:
+        if pattern.search(text):
+            return HeuristicResult(False, message)
 
     return HeuristicResult(True, text)
 
 def apply_answer_heuristics(answer: str) -> str:
+    # 8) long / blob output check (masking keeps the length, so check first
+    #    and only filter the head that is kept, plus room for a word
+    #    crossing the cut)
+    if len(answer) > 4000:
+        head = _mask_banned_words(answer[:1000 + max(_BANNED_MAX_LEN - 1, 0)])[:1000]
+        return f"FURTHER_PROCESSING_REQUIRED: {head}..."
     # 9) banned words filter (simple)
-    filtered = answer
-    for w in BANNED_WORDS:
-        filtered = re.sub(w, "*" * len(w), filtered, flags=re.IGNORECASE)
-    # 8) long / blob output check
-    if len(filtered) > 4000:
-        return f"FURTHER_PROCESSING_REQUIRED: {filtered[:1000]}..."
-    return filtered
\ No newline at end of file
+    return _mask_banned_words(answer)
\ No newline at end of file
@@ -1,9 +1,18 @@
-import json
+import bisect
+import mmap
 import re
+import sys
 import difflib
-from dataclasses import dataclass
+import functools
+import heapq
+import operator
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+
+from modules import historical_store
+# JSON codec (orjson when installed), shared with the SQLite store
+from modules.historical_store import _json_dumps, _json_loads
 
 # -------------------------------------------------------------------
 # Optional logging from agent.py
@@ -27,6 +36,49 @@ except ImportError:  # pragma: no cover - very small fallback
     yaml = None
 
 
+# -------------------------------------------------------------------
+# Optional streaming JSON parser (for session memory files)
+# -------------------------------------------------------------------
+try:
+    import ijson
+except ImportError:  # pragma: no cover - falls back to json.load
+    ijson = None
+
+
+# -------------------------------------------------------------------
+# Optional C string matcher (prefilter for find_best_cached_answer)
+# -------------------------------------------------------------------
+try:
+    from rapidfuzz.fuzz import ratio as _rf_ratio
+    from rapidfuzz.process import extract as _rf_extract
+except ImportError:  # pragma: no cover - difflib bounds only
+    _rf_ratio = None
+    _rf_extract = None
+
+
+# -------------------------------------------------------------------
+# Optional numpy (vectorized keyword scoring, embedding vectors)
+# -------------------------------------------------------------------
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - pure Python scoring
+    np = None
+
+
+# -------------------------------------------------------------------
+# Optional embedding index (numpy + faiss + Ollama embeddings)
+# -------------------------------------------------------------------
+try:
+    import faiss
+    import requests
+except ImportError:  # pragma: no cover - embedding cache is optional
+    faiss = None
+    requests = None
+
+_EMBED_URL = "http://localhost:11434/api/embeddings"
+_EMBED_MODEL = "nomic-embed-text"
+
+
 # -------------------------------------------------------------------
 # Data model
 # -------------------------------------------------------------------
@@ -59,7 +111,8 @@ class HistoricalExample:
 # Config helpers
 # -------------------------------------------------------------------
 
-_DEFAULT_INDEX_PATH = Path("memory") / "historical_conversation_store.json"
+_DEFAULT_INDEX_PATH = Path("memory") / "historical_conversation_store.jsonl"
+_PROFILES_PATH = Path("config") / "profiles.yaml"
 
 
 def _load_profiles_custom_config() -> Dict[str, Any]:
@@ -71,17 +124,29 @@ def _load_profiles_custom_config() -> Dict[str, Any]:
       custom_config:
         jaccard_similarity_threshold: 0.85
         verbose_logging: true
-        memory_index_file: "memory/historical_conversation_store.json"
+        memory_index_file: "memory/historical_conversation_store.jsonl"
+
+    The parsed result is cached per file mtime, so repeated lookups cost a
+    stat() and an edited profiles.yaml is still picked up.
     """
     if yaml is None:
         return {}
 
-    profiles_path = Path("config") / "profiles.yaml"
-    if not profiles_path.exists():
+    try:
+        mtime_ns = _PROFILES_PATH.stat().st_mtime_ns
+    except OSError:
         return {}
+    return _load_profiles_cached(mtime_ns)
 
+
+@functools.lru_cache(maxsize=1)
+def _load_profiles_cached(mtime_ns: int) -> Dict[str, Any]:
+    """
+    Parse custom_config out of profiles.yaml; `mtime_ns` is only the cache key.
+    Callers must treat the returned dict as read-only.
+    """
     try:
-        with profiles_path.open("r", encoding="utf-8") as f:
+        with _PROFILES_PATH.open("r", encoding="utf-8") as f:
             data = yaml.safe_load(f) or {}
     except Exception as e:
         log("history", f"Failed to read profiles.yaml: {e}")
@@ -100,13 +165,30 @@ def _get_index_path() -> Path:
 
     Priority:
     1. custom_config.memory_index_file from config/profiles.yaml
-    2. Fallback: memory/historical_conversation_store.json
+    2. Fallback: memory/historical_conversation_store.jsonl
+
+    A .db / .sqlite / .sqlite3 path selects the SQLite store
+    (see modules/historical_store.py), a .jsonl path the append-only
+    JSON-lines store; anything else is a single JSON array file.
     """
     cfg = _load_profiles_custom_config()
     path_str = cfg.get("memory_index_file")
     if isinstance(path_str, str) and path_str.strip():
-        return Path(path_str.strip())
-    return _DEFAULT_INDEX_PATH
+        path = Path(path_str.strip())
+    else:
+        path = _DEFAULT_INDEX_PATH
+    if _is_jsonl_path(path) and not path.exists():
+        _migrate_legacy_json(path)
+    return path
+
+def get_index_path() -> Path:
+    """
+    Resolve the historical index path once (see _get_index_path). Callers
+    like AgentLoop keep it and pass it back as `index_path=`, so per-call
+    lookups skip re-reading profiles.yaml.
+    """
+    return _get_index_path()
+
 
 def _get_top_k_value() -> int:
     """
@@ -120,39 +202,72 @@ def _get_top_k_value() -> int:
     return 3
 
 
+def _get_embedding_settings() -> Tuple[bool, float]:
+    """
+    Read the optional embedding cache settings from custom_config:
+
+      custom_config:
+        use_embedding_cache: true
+        embedding_similarity_threshold: 0.92
+
+    The embedding cache is off by default and silently disabled when
+    numpy / faiss are not installed.
+    """
+    cfg = _load_profiles_custom_config()
+    enabled = bool(cfg.get("use_embedding_cache", False)) and faiss is not None
+    threshold = cfg.get("embedding_similarity_threshold")
+    if not isinstance(threshold, (int, float)) or not 0 < threshold <= 1:
+        threshold = 0.92
+    return enabled, float(threshold)
+
+
 # -------------------------------------------------------------------
 # Text normalization + similarity
 # -------------------------------------------------------------------
 
-_STOPWORDS = {
+_STOPWORDS = frozenset({
     "the", "is", "a", "an", "of", "and", "or", "to", "in", "on", "for",
     "with", "at", "by", "from", "as", "about", "what", "which", "who",
     "how", "much", "many", "when", "where", "why", "do", "does", "did",
     "his", "her", "their", "its", "this", "that", "these", "those",
-}
+})
+
 
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_WS_RE = re.compile(r"\s+")
 
-def _normalize_text(text: str) -> List[str]:
+
+def _keyword_set(text: str) -> FrozenSet[str]:
     """
     Very lightweight tokenizer + stopword removal for keyword extraction.
+    Returns the interned keyword set in one go: tokens are de-duplicated
+    and stopword-filtered by set operations, not a per-token Python filter.
+    """
+    return frozenset(map(sys.intern, set(_TOKEN_RE.findall(text.lower())) - _STOPWORDS))
+
+
+def _stored_keywords(text: str) -> List[str]:
+    """
+    Keywords as persisted on index entries: sorted and de-duplicated, so
+    the stored list is the set the similarity code works with.
     """
-    text = text.lower()
-    tokens = re.findall(r"[a-z0-9]+", text)
-    return [t for t in tokens if t not in _STOPWORDS]
+    return sorted(_keyword_set(text))
 
 
 def _normalize_for_similarity(text: str) -> str:
     """
     Normalize a string for semantic-ish similarity comparison.
     """
-    text = text.lower().strip()
-    text = re.sub(r"\s+", " ", text)
-    return text
+    return _WS_RE.sub(" ", text.lower().strip())
 
 
 def _string_similarity(a: str, b: str) -> float:
     """
     Character-level similarity (SequenceMatcher), for paraphrase-style checks.
+
+    The cache-hit thresholds in profiles.yaml are tuned for this ratio;
+    rapidfuzz's Indel ratio scores systematically higher and is only used
+    as a prefilter (see find_best_cached_answer_ctx).
     """
     return difflib.SequenceMatcher(
         None,
@@ -161,10 +276,90 @@ def _string_similarity(a: str, b: str) -> float:
     ).ratio()
 
 
+@dataclass(frozen=True)
+class QueryCtx:
+    """
+    A user query prepared once for both historical lookups
+    (find_best_cached_answer_ctx and load_similar_examples_ctx).
+    Each derived form is computed on first use and then kept.
+    """
+    text: str
+
+    @classmethod
+    def from_query(cls, text: str) -> "QueryCtx":
+        return cls(text)
+
+    @functools.cached_property
+    def norm(self) -> str:
+        return _normalize_for_similarity(self.text)
+
+    @functools.cached_property
+    def keywords(self) -> FrozenSet[str]:
+        return _keyword_set(self.text)
+
+    @functools.cached_property
+    def bits(self) -> int:
+        return _char_bits(self.norm)
+
+
 # -------------------------------------------------------------------
 # Index I/O
 # -------------------------------------------------------------------
 
+def _is_jsonl_path(path: Path) -> bool:
+    return path.suffix.lower() == ".jsonl"
+
+
+def _load_jsonl(index_path: Path) -> List[Dict[str, Any]]:
+    """
+    Parse one record per line straight from a read-only mmap of the file.
+    A torn last line (interrupted append) is skipped, not fatal.
+    """
+    items: List[Dict[str, Any]] = []
+    with index_path.open("rb") as f:
+        if f.seek(0, 2) == 0:
+            return items  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                if not line.strip():
+                    continue
+                try:
+                    items.append(_json_loads(line))
+                except ValueError:
+                    log("history", f"Skipping unreadable line in {index_path}.")
+    return items
+
+
+def _append_index(index_path: Path, items: List[Dict[str, Any]]) -> None:
+    """
+    Append new records to a .jsonl store in a single write.
+    """
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    data = b"".join(_json_dumps(it) + b"\n" for it in items)
+    with index_path.open("a+b") as f:
+        # Terminate a torn last line first, so it cannot swallow the new record
+        if f.seek(0, 2) > 0:
+            f.seek(-1, 2)
+            if f.read(1) != b"\n":
+                data = b"\n" + data
+        f.write(data)
+    _invalidate_index_cache(index_path)
+
+
+def _migrate_legacy_json(index_path: Path) -> None:
+    """
+    One-time import of the old single-array JSON store sitting next to a
+    not-yet-created .jsonl store (the legacy file itself is left as is).
+    """
+    legacy = index_path.with_suffix(".json")
+    if not legacy.exists():
+        return
+    items = _load_index(legacy)
+    if items:
+        _append_index(index_path, items)
+        log("history", f"Migrated {len(items)} entries from {legacy} to {index_path}.")
+
+
 def _load_index(index_path: Optional[Path] = None) -> List[Dict[str, Any]]:
     """
     Load the global historical index as a list of dicts.
@@ -176,8 +371,11 @@ def _load_index(index_path: Optional[Path] = None) -> List[Dict[str, Any]]:
         return []
 
     try:
-        with index_path.open("r", encoding="utf-8") as f:
-            data = json.load(f)
+        if historical_store.is_sqlite_path(index_path):
+            return historical_store.load_items(index_path)
+        if _is_jsonl_path(index_path):
+            return _load_jsonl(index_path)
+        data = _json_loads(index_path.read_bytes())
         return data if isinstance(data, list) else []
     except Exception as e:
         log("history", f"Failed to load historical index: {e}")
@@ -191,9 +389,180 @@ def _save_index(index_path: Optional[Path], items: List[Dict[str, Any]]) -> None
     if index_path is None:
         index_path = _get_index_path()
 
-    index_path.parent.mkdir(parents=True, exist_ok=True)
-    with index_path.open("w", encoding="utf-8") as f:
-        json.dump(items, f, indent=2, ensure_ascii=False)
+    if historical_store.is_sqlite_path(index_path):
+        historical_store.replace_all_items(index_path, items)
+    elif _is_jsonl_path(index_path):
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_name(index_path.name + ".tmp")
+        # Streamed line by line: the whole serialized store is never held
+        # in memory (appends keep their single write, see _append_index)
+        with tmp_path.open("wb") as f:
+            f.writelines(_json_dumps(it) + b"\n" for it in items)
+        tmp_path.replace(index_path)
+    else:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        index_path.write_bytes(_json_dumps(items, indent=True))
+    _invalidate_index_cache(index_path)
+
+
+def _index_stamp(index_path: Path) -> Optional[Tuple[int, ...]]:
+    """
+    Change marker for the index file (None if missing). SQLite writes land
+    in the -wal file until a checkpoint, so that file is included too.
+    """
+    paths = [index_path]
+    if historical_store.is_sqlite_path(index_path):
+        paths.append(index_path.with_name(index_path.name + "-wal"))
+    stamp: List[int] = []
+    for p in paths:
+        try:
+            st = p.stat()
+        except OSError:
+            if p is index_path:
+                return None
+            continue
+        stamp.extend((st.st_mtime_ns, st.st_size))
+    return tuple(stamp)
+
+
+# index path -> (stamp, parsed items); shared, read-only for callers
+_INDEX_CACHE: Dict[Path, Tuple[Optional[Tuple[int, ...]], List[Dict[str, Any]]]] = {}
+
+
+def _load_index_cached(index_path: Path) -> List[Dict[str, Any]]:
+    """
+    _load_index, re-parsed only when the file changed since the last call.
+    The returned list is shared: do not mutate it.
+    """
+    stamp = _index_stamp(index_path)
+    cached = _INDEX_CACHE.get(index_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    items = _load_index(index_path) if stamp is not None else []
+    _INDEX_CACHE[index_path] = (stamp, items)
+    return items
+
+
+def _invalidate_index_cache(index_path: Path) -> None:
+    """
+    Drop the parsed copies of `index_path` after writing it. The stamp check
+    alone can miss a rewrite that keeps the size within one mtime tick.
+    """
+    _INDEX_CACHE.pop(index_path, None)
+    _KEYWORD_INDEX_CACHE.pop(index_path, None)
+    _PARAPHRASE_CACHE.pop(index_path, None)
+
+
+# -------------------------------------------------------------------
+# Vector index I/O (ANN over query embeddings)
+# -------------------------------------------------------------------
+
+def _get_vector_index_paths(index_path: Path) -> Tuple[Path, Path]:
+    """
+    The vector index lives next to the JSON store:
+      memory/historical_conversation_store.faiss       (HNSW graph)
+      memory/historical_conversation_store.faiss.json  (row -> (session_id, turn_index))
+    """
+    vec_path = index_path.with_suffix(".faiss")
+    return vec_path, vec_path.with_name(vec_path.name + ".json")
+
+
+# query text -> normalized embedding; the cache lookup and the similar
+# examples lookup embed the same user query, so it is only sent once
+_QUERY_VEC_CACHE: Dict[str, Any] = {}
+_QUERY_VEC_CACHE_MAX = 128
+
+# index path -> (stamp of the .faiss file, vindex, keys)
+_VECTOR_INDEX_CACHE: Dict[Path, Tuple[Any, Any, List[List[Any]]]] = {}
+
+
+def _embed(text: str) -> Optional["np.ndarray"]:
+    """
+    Embed text with the local Ollama embedding model and L2-normalize it,
+    so inner product == cosine similarity.
+    """
+    cached = _QUERY_VEC_CACHE.get(text)
+    if cached is not None:
+        return cached
+    try:
+        resp = requests.post(
+            _EMBED_URL, json={"model": _EMBED_MODEL, "prompt": text}, timeout=10
+        )
+        resp.raise_for_status()
+        vec = np.asarray(resp.json()["embedding"], dtype=np.float32).reshape(1, -1)
+    except Exception as e:
+        log("history", f"Embedding failed: {e}")
+        return None
+    faiss.normalize_L2(vec)
+    if len(_QUERY_VEC_CACHE) >= _QUERY_VEC_CACHE_MAX:
+        _QUERY_VEC_CACHE.clear()
+    _QUERY_VEC_CACHE[text] = vec
+    return vec
+
+
+def _load_vector_index(index_path: Path) -> Tuple[Optional[Any], List[List[Any]]]:
+    """
+    Load the HNSW index and its row -> (session_id, turn_index) mapping.
+    """
+    vec_path, keys_path = _get_vector_index_paths(index_path)
+    if not vec_path.exists() or not keys_path.exists():
+        return None, []
+    try:
+        vindex = faiss.read_index(str(vec_path))
+        keys = _json_loads(keys_path.read_bytes())
+    except Exception as e:
+        log("history", f"Failed to load vector index: {e}")
+        return None, []
+    if vindex.ntotal != len(keys):
+        log("history", "Vector index out of sync with its key map; rebuilding.")
+        return None, []
+    return vindex, keys
+
+
+def _get_vector_index(index_path: Path) -> Tuple[Optional[Any], List[List[Any]]]:
+    """
+    Read-only access to the vector index for lookups, re-read from disk only
+    when the .faiss file changed.
+    """
+    vec_path, _ = _get_vector_index_paths(index_path)
+    stamp = _index_stamp(vec_path)
+    cached = _VECTOR_INDEX_CACHE.get(index_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1], cached[2]
+    vindex, keys = _load_vector_index(index_path)
+    _VECTOR_INDEX_CACHE[index_path] = (stamp, vindex, keys)
+    return vindex, keys
+
+
+def _update_vector_index(index_path: Path, items: List[Dict[str, Any]]) -> None:
+    """
+    Embed any indexed queries that are not in the vector index yet and
+    append them to the HNSW graph (no rebuild of existing rows).
+    """
+    vindex, keys = _load_vector_index(index_path)
+    known = {tuple(k) for k in keys}
+    added = 0
+
+    for it in items:
+        key = (it.get("session_id"), it.get("turn_index"))
+        uq = it.get("user_query")
+        if key in known or not isinstance(uq, str):
+            continue
+        vec = _embed(uq)
+        if vec is None:
+            break  # embedding service unavailable; retry on next update
+        if vindex is None:
+            vindex = faiss.IndexHNSWFlat(vec.shape[1], 32, faiss.METRIC_INNER_PRODUCT)
+        vindex.add(vec)
+        keys.append(list(key))
+        known.add(key)
+        added += 1
+
+    if added:
+        vec_path, keys_path = _get_vector_index_paths(index_path)
+        faiss.write_index(vindex, str(vec_path))
+        keys_path.write_bytes(_json_dumps(keys))
+        log("history", f"Added {added} embeddings to vector index.")
 
 
 # -------------------------------------------------------------------
@@ -233,107 +602,112 @@ def _extract_final_answer(entry: Dict[str, Any]) -> Optional[str]:
     return None
 
 
+# Markers of a "junk" FINAL_ANSWER, matched case-insensitively in one scan
+_BAD_FA_RE = re.compile(r"could not generate|unknown|unexpected", re.IGNORECASE)
+
+
 def _should_index_final_answer(fa: str) -> bool:
     """
     Filter out "junk" FINAL_ANSWER strings.
     """
-    if not fa.startswith("FINAL_ANSWER:"):
-        return False
-    lowered = fa.lower()
-    for bad in ["could not generate", "unknown", "unexpected"]:
-        if bad in lowered:
-            return False
-    return True
+    return fa.startswith("FINAL_ANSWER:") and _BAD_FA_RE.search(fa) is None
 
 
-def _parse_session_memory(memory_path: Path, session_id: str) -> List[HistoricalExample]:
+def _iter_session_events(f: Any) -> Iterator[Any]:
     """
-    Read the per-session memory file and extract (query, FINAL_ANSWER) pairs.
+    Yield the events of a session memory file (a JSON list), streamed
+    with ijson when available so the whole list is never materialized.
     """
-    try:
-        with memory_path.open("r", encoding="utf-8") as f:
-            events = json.load(f)
-    except Exception as e:
-        log("history", f"Failed to read {memory_path}: {e}")
-        return []
-
+    if ijson is not None:
+        yield from ijson.items(f, "item")
+        return
+    events = _json_loads(f.read())
     if not isinstance(events, list):
-        log("history", f"Memory file {memory_path} not a list; skipping.")
-        return []
-
-    examples: List[HistoricalExample] = []
-    i = 0
-    turn_idx = 0
-
-    while i < len(events):
-        evt = events[i]
-        i += 1
-
-        if evt.get("type") != "run_metadata":
-            continue
-
-        txt = evt.get("text") or ""
-        if "Started new session with input:" not in txt:
-            continue
+        raise ValueError("not a list")
+    yield from events
 
-        user_query = _extract_user_query(txt)
-        if not user_query:
-            continue
-
-        final_answer: Optional[str] = None
-        tools_used: List[str] = []
-        successful_tools: List[str] = []
-        tags: List[str] = []
-
-        j = i
-        while j < len(events):
-            evt2 = events[j]
-            if evt2.get("type") == "run_metadata":
-                break
-
-            # 1) Tools and tags as before
-            if evt2.get("type") == "tool_output":
-                tool_name = evt2.get("tool_name")
-                if tool_name:
-                    tools_used.append(tool_name)
-                    if evt2.get("success") is True:
-                        successful_tools.append(tool_name)
-
-                fa = _extract_final_answer(evt2)
-                if fa:
-                    final_answer = fa
-
-                evt_tags = evt2.get("tags") or []
-                if isinstance(evt_tags, list):
-                    tags.extend(str(t) for t in evt_tags)
 
-            # 2) NEW: always check for final_answer in ANY event
-            fa = _extract_final_answer(evt2)
-            if fa:
-                final_answer = fa
-
-            j += 1
-
-        i = j
-
-        if not final_answer or not _should_index_final_answer(final_answer):
-            continue
+def _parse_session_memory(memory_path: Path, session_id: str) -> List[HistoricalExample]:
+    """
+    Read the per-session memory file and extract (query, FINAL_ANSWER) pairs.
 
-        keywords = _normalize_text(user_query)
+    Single forward pass: each run_metadata event closes the previous run
+    and (if it carries a user query) opens the next one.
+    """
+    examples: List[HistoricalExample] = []
+    user_query: Optional[str] = None
+    final_answer: Optional[str] = None
+    # per-run lists are de-duplicated on append (first occurrence wins),
+    # with a set alongside each to test membership
+    tools_used: List[str] = []
+    successful_tools: List[str] = []
+    tags: List[str] = []
+    seen_tools: Set[str] = set()
+    seen_successful: Set[str] = set()
+    seen_tags: Set[str] = set()
+
+    def close_run() -> None:
+        if not user_query or not final_answer or not _should_index_final_answer(final_answer):
+            return
         examples.append(
             HistoricalExample(
                 session_id=session_id,
-                turn_index=turn_idx,
+                turn_index=len(examples),
                 user_query=user_query,
                 final_answer=final_answer,
-                tools_used=list(dict.fromkeys(tools_used)),
-                successful_tools=list(dict.fromkeys(successful_tools)),
-                tags=list(dict.fromkeys(tags)),
-                keywords=keywords,
+                tools_used=tools_used,
+                successful_tools=successful_tools,
+                tags=tags,
+                keywords=_stored_keywords(user_query),
             )
         )
-        turn_idx += 1
 
+    try:
+        with memory_path.open("rb") as f:
+            for evt in _iter_session_events(f):
+                if not isinstance(evt, dict):
+                    continue
+                evt_type = evt.get("type")
+
+                if evt_type == "run_metadata":
+                    close_run()
+                    txt = evt.get("text") or ""
+                    user_query = _extract_user_query(txt)
+                    final_answer = None
+                    tools_used, successful_tools, tags = [], [], []
+                    seen_tools, seen_successful, seen_tags = set(), set(), set()
+                    continue
+
+                if not user_query:
+                    continue  # outside of a run
+
+                if evt_type == "tool_output":
+                    tool_name = evt.get("tool_name")
+                    if tool_name:
+                        if tool_name not in seen_tools:
+                            seen_tools.add(tool_name)
+                            tools_used.append(tool_name)
+                        if evt.get("success") is True and tool_name not in seen_successful:
+                            seen_successful.add(tool_name)
+                            successful_tools.append(tool_name)
+
+                    evt_tags = evt.get("tags") or []
+                    if isinstance(evt_tags, list):
+                        for t in evt_tags:
+                            t = str(t)
+                            if t not in seen_tags:
+                                seen_tags.add(t)
+                                tags.append(t)
+
+                # final_answer can appear in ANY event
+                fa = _extract_final_answer(evt)
+                if fa:
+                    final_answer = fa
+    except Exception as e:
+        log("history", f"Failed to read {memory_path}: {e}")
+        return []
+
+    close_run()
     return examples
 
 
@@ -341,6 +715,19 @@ def _parse_session_memory(memory_path: Path, session_id: str) -> List[Historical
 # UPDATE INDEX
 # -------------------------------------------------------------------
 
+def _fill_missing_keywords(index: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+    """
+    Copy of `index` with "keywords" computed for entries that lack them,
+    or None if every entry already has them.
+    """
+    if all("keywords" in it for it in index):
+        return None
+    return [
+        it if "keywords" in it else {**it, "keywords": _stored_keywords(it.get("user_query") or "")}
+        for it in index
+    ]
+
+
 def update_index_for_session(memory_path_str: str, session_id: str) -> None:
     """
     Incrementally update the global historical index for this session.
@@ -348,72 +735,138 @@ def update_index_for_session(memory_path_str: str, session_id: str) -> None:
     NOTE: The actual index file path is determined by config/profiles.yaml
     (custom_config.memory_index_file) with a safe fallback.
     """
-    memory_path = Path(memory_path_str)
-    index_path = _get_index_path()
+    update_index_for_sessions([(memory_path_str, session_id)])
+
+
+def update_index_for_sessions(
+    pairs: List[Tuple[str, str]],
+    index_path: Optional[Path] = None,
+) -> None:
+    """
+    Batched update_index_for_session over (memory_path, session_id) pairs:
+    the index is loaded, merged and written once for all of them.
+    """
+    if not pairs:
+        return
+    if index_path is None:
+        index_path = _get_index_path()
+    session_ids = ", ".join(sid for _, sid in pairs)
 
     try:
-        new_examples = _parse_session_memory(memory_path, session_id)
+        new_examples: List[HistoricalExample] = []
+        for memory_path_str, session_id in pairs:
+            new_examples.extend(_parse_session_memory(Path(memory_path_str), session_id))
         if not new_examples:
-            log("history", f"No indexable examples found for session {session_id}.")
+            log("history", f"No indexable examples found for session {session_ids}.")
             return
 
-        index = _load_index(index_path)
-        existing = {(it.get("session_id"), it.get("turn_index")) for it in index}
-        added = 0
-
-        for ex in new_examples:
-            key = (ex.session_id, ex.turn_index)
-            if key in existing:
-                continue
-            index.append(ex.to_dict())
-            existing.add(key)
-            added += 1
+        if historical_store.is_sqlite_path(index_path):
+            # Keyed INSERT of just these sessions' rows; no full-store rewrite
+            index = None
+            added = historical_store.insert_new_items(
+                index_path, [ex.to_dict() for ex in new_examples]
+            )
+            if added:
+                _invalidate_index_cache(index_path)
+        else:
+            index = _load_index_cached(index_path)
+            # Older entries without "keywords" get them filled in and written
+            # back once, so later index loads skip tokenizing them
+            backfilled = _fill_missing_keywords(index)
+            if backfilled is not None:
+                index = backfilled
+            existing = {(it.get("session_id"), it.get("turn_index")) for it in index}
+            new_items: List[Dict[str, Any]] = []
+
+            for ex in new_examples:
+                key = (ex.session_id, ex.turn_index)
+                if key in existing:
+                    continue
+                new_items.append(ex.to_dict())
+                existing.add(key)
+            added = len(new_items)
+
+            if backfilled is not None:
+                index = index + new_items
+                _save_index(index_path, index)
+            elif added:
+                index = index + new_items
+                if _is_jsonl_path(index_path):
+                    # Append-only: just the new lines, no rewrite of the store
+                    _append_index(index_path, new_items)
+                else:
+                    _save_index(index_path, index)
 
         if added:
-            _save_index(index_path, index)
-            log("history", f"✅ Updated historical index for session {session_id} (added {added} entries).")
+            log("history", f"✅ Updated historical index for session {session_ids} (added {added} entries).")
         else:
-            log("history", f"Historical index already up-to-date for session {session_id}.")
+            log("history", f"Historical index already up-to-date for session {session_ids}.")
+
+        use_embeddings, _ = _get_embedding_settings()
+        if use_embeddings:
+            _update_vector_index(index_path, index if index is not None else _load_index_cached(index_path))
     except Exception as e:
-        log("history", f"Failed to update index for session {session_id}: {e}")
+        log("history", f"Failed to update index for session {session_ids}: {e}")
 
 
 # -------------------------------------------------------------------
 # SIMPLE JACCARD (for ranking similar queries)
 # -------------------------------------------------------------------
 
-def _jaccard_similarity(a: List[str], b: List[str]) -> float:
-    sa, sb = set(a), set(b)
+def _jaccard_similarity(sa: FrozenSet[str], sb: FrozenSet[str]) -> float:
+    """
+    Jaccard over two keyword sets. |A ∪ B| is derived as |A| + |B| - |A ∩ B|,
+    so only the (small) intersection set is materialized.
+
+    Both sides are expected to be prebuilt frozensets (the query's once per
+    lookup, the rows' in _KeywordIndex.keyword_sets), never rebuilt here.
+    """
     if not sa or not sb:
         return 0.0
-    return len(sa & sb) / len(sa | sb)
+    inter = len(sa & sb)
+    return inter / (len(sa) + len(sb) - inter)
 
 
 # -------------------------------------------------------------------
-# LOAD TOP-K SIMILAR EXAMPLES FOR DECISION PROMPT
+# INVERTED KEYWORD INDEX (for load_similar_examples)
 # -------------------------------------------------------------------
 
-def load_similar_examples(
-    user_query: str,
-    top_k: int = _get_top_k_value(), # Get from config/profiles.yaml
-    memory_root: Optional[str] = None,  # kept for backwards compat, but ignored
-) -> List[Dict[str, Any]]:
+@dataclass
+class _KeywordIndex:
     """
-    Return up to `top_k` historical examples most similar to `user_query`
-    using Jaccard similarity over keyword sets.
-
-    Path to the index file is taken from config/profiles.yaml (if present).
+    Usable examples of one index file plus keyword -> row postings, so a
+    query only scores rows sharing at least one keyword with it.
     """
-    index_path = _get_index_path()
-    index = _load_index(index_path)
+    stamp: Optional[Tuple[int, ...]]
+    items: List[Dict[str, Any]] = field(default_factory=list)
+    keyword_sets: List[FrozenSet[str]] = field(default_factory=list)
+    postings: Dict[str, List[int]] = field(default_factory=dict)
+    rows_by_key: Dict[Tuple[Any, Any], int] = field(default_factory=dict)
+    # numpy copies of postings / keyword set sizes, built on first
+    # vectorized lookup (see _rank_by_keywords_vectorized)
+    posting_arrays: Optional[Dict[str, Any]] = None
+    set_sizes: Any = None
 
-    if not index:
-        return []
 
-    qkw = _normalize_text(user_query)
-    scored: List[Any] = []
+# Below this many rows the per-row Python loop beats numpy's call overhead
+_VECTORIZE_MIN_ROWS = 2048
 
-    for item in index:
+
+_KEYWORD_INDEX_CACHE: Dict[Path, _KeywordIndex] = {}
+
+
+def _get_keyword_index(index_path: Path) -> _KeywordIndex:
+    """
+    Return the inverted index for `index_path`, rebuilding it only when the
+    file changed since it was last built.
+    """
+    stamp = _index_stamp(index_path)
+    cached = _KEYWORD_INDEX_CACHE.get(index_path)
+    if cached is not None and cached.stamp == stamp:
+        return cached
+
+    kidx = _KeywordIndex(stamp=stamp)
+    for item in _load_index_cached(index_path):
         fa = item.get("final_answer")
         uq = item.get("user_query")
 
@@ -424,21 +877,189 @@ def load_similar_examples(
         if fa.strip() == "FINAL_ANSWER: [Could not generate valid solve()]":
             continue
 
-        kw = item.get("keywords") or _normalize_text(uq)
-        sim = _jaccard_similarity(qkw, kw)
-        if sim > 0:
-            scored.append((sim, item))
+        # Interned, so the postings keys, row sets and query set share
+        # string objects and set ops compare keywords by identity
+        kw = item.get("keywords")
+        kw = frozenset(map(sys.intern, kw)) if kw else _keyword_set(uq)
+        if not kw:
+            continue
+        row = len(kidx.items)
+        kidx.items.append(item)
+        kidx.keyword_sets.append(kw)
+        kidx.rows_by_key[(item.get("session_id"), item.get("turn_index"))] = row
+        for w in kw:
+            kidx.postings.setdefault(w, []).append(row)
 
-    if not scored:
+    _KEYWORD_INDEX_CACHE[index_path] = kidx
+    return kidx
+
+
+# -------------------------------------------------------------------
+# LOAD TOP-K SIMILAR EXAMPLES FOR DECISION PROMPT
+# -------------------------------------------------------------------
+
+def _similar_by_embedding(
+    user_query: str,
+    index_path: Path,
+    kidx: _KeywordIndex,
+    qkw: FrozenSet[str],
+    top_k: int,
+) -> Optional[List[Tuple[float, Dict[str, Any]]]]:
+    """
+    Rank examples by cosine similarity of query embeddings (HNSW search),
+    Jaccard as tie-break. Returns None if the vector index is unavailable,
+    so the caller falls back to keyword ranking.
+    """
+    vindex, keys = _get_vector_index(index_path)
+    if vindex is None or not keys:
+        return None
+
+    vec = _embed(user_query)
+    if vec is None:
+        return None
+
+    # Over-fetch: some neighbours may be rows load_similar_examples skips
+    scores, rows = vindex.search(vec, min(len(keys), top_k * 4))
+    ranked: List[Tuple[float, float, Dict[str, Any]]] = []
+    for vrow, sim in zip(rows[0], scores[0]):
+        if vrow < 0 or sim <= 0:
+            continue
+        row = kidx.rows_by_key.get(tuple(keys[vrow]))
+        if row is None:
+            continue
+        jac = _jaccard_similarity(qkw, kidx.keyword_sets[row])
+        ranked.append((float(sim), jac, kidx.items[row]))
+
+    top = heapq.nlargest(top_k, ranked, key=operator.itemgetter(0, 1))
+    return [(sim, item) for sim, _, item in top]
+
+
+def _rank_by_keywords(
+    kidx: _KeywordIndex,
+    qkw: FrozenSet[str],
+    top_k: int,
+) -> List[Tuple[float, Dict[str, Any]]]:
+    """
+    Top `top_k` rows by Jaccard similarity to `qkw`, best first; equal
+    scores keep index order.
+    """
+    # |q ∩ d| per candidate row, accumulated from the postings lists
+    # (a sparse query-vector x keyword-matrix product), so no
+    # intersection sets are built
+    overlap: Dict[int, int] = {}
+    get = overlap.get
+    for w in qkw:
+        for row in kidx.postings.get(w, ()):
+            overlap[row] = get(row, 0) + 1
+    if not overlap:
+        return []
+
+    # Sorted rows keep index order among equal scores (nlargest is stable)
+    nq = len(qkw)
+    sets = kidx.keyword_sets
+    return heapq.nlargest(
+        top_k,
+        ((inter / (nq + len(sets[row]) - inter), kidx.items[row])
+         for row, inter in sorted(overlap.items())),
+        key=operator.itemgetter(0),
+    )
+
+
+def _rank_by_keywords_vectorized(
+    kidx: _KeywordIndex,
+    qkw: FrozenSet[str],
+    top_k: int,
+) -> List[Tuple[float, Dict[str, Any]]]:
+    """
+    _rank_by_keywords with numpy: overlap counts via one bincount over the
+    query's postings, Jaccard for all candidate rows at once, and a
+    partition instead of a full sort. Same result and tie order.
+    """
+    posting_arrays = kidx.posting_arrays
+    if posting_arrays is None:
+        # Lookups run in executor threads: built in locals and published
+        # with posting_arrays last, so a concurrent lookup that sees it
+        # also sees set_sizes
+        posting_arrays = {w: np.asarray(rows, dtype=np.intp) for w, rows in kidx.postings.items()}
+        set_sizes = np.fromiter(map(len, kidx.keyword_sets), dtype=np.intp, count=len(kidx.keyword_sets))
+        kidx.set_sizes = set_sizes
+        kidx.posting_arrays = posting_arrays
+
+    hits = [posting_arrays[w] for w in qkw if w in posting_arrays]
+    if not hits:
+        return []
+    counts = np.bincount(np.concatenate(hits), minlength=len(kidx.items))
+    rows = np.flatnonzero(counts)  # ascending, i.e. index order
+    inter = counts[rows]
+    scores = inter / (len(qkw) + kidx.set_sizes[rows] - inter)
+
+    if len(rows) > top_k:
+        # keep everything tied with the k-th best, then order exactly
+        kth = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+        keep = scores >= kth
+        rows, scores = rows[keep], scores[keep]
+    order = np.lexsort((rows, -scores))[:top_k]
+    return [(float(scores[i]), kidx.items[rows[i]]) for i in order]
+
+
+def load_similar_examples(
+    user_query: str,
+    top_k: Optional[int] = None,  # None: top_k_similar_examples from config/profiles.yaml
+    memory_root: Optional[str] = None,  # kept for backwards compat, but ignored
+    index_path: Optional[Path] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Return up to `top_k` historical examples most similar to `user_query`
+    (see load_similar_examples_ctx).
+    """
+    return load_similar_examples_ctx(QueryCtx.from_query(user_query), top_k=top_k, index_path=index_path)
+
+
+def load_similar_examples_ctx(
+    query: QueryCtx,
+    top_k: Optional[int] = None,
+    index_path: Optional[Path] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Return up to `top_k` historical examples most similar to `query`.
+
+    With use_embedding_cache enabled, examples are ranked by embedding
+    similarity via the HNSW vector index. Otherwise (or if it is
+    unavailable) Jaccard similarity over keyword sets is used, scoring only
+    rows sharing a keyword with the query (via the cached inverted index).
+
+    Path to the index file is `index_path` if given, else taken from
+    config/profiles.yaml (if present).
+    """
+    if top_k is None:
+        top_k = _get_top_k_value()
+    if index_path is None:
+        index_path = _get_index_path()
+    kidx = _get_keyword_index(index_path)
+    if not kidx.items:
         return []
 
-    scored.sort(key=lambda x: x[0], reverse=True)
-    top_items = [it for _, it in scored[:top_k]]
+    user_query = query.text
+    qkw = query.keywords  # built once per query, not per item
+
+    scored = None
+    use_embeddings, _ = _get_embedding_settings()
+    if use_embeddings:
+        scored = _similar_by_embedding(user_query, index_path, kidx, qkw, top_k)
+
+    if scored is None:
+        if np is not None and len(kidx.items) >= _VECTORIZE_MIN_ROWS:
+            scored = _rank_by_keywords_vectorized(kidx, qkw, top_k)
+        else:
+            scored = _rank_by_keywords(kidx, qkw, top_k)
+    if not scored:
+        return []
+    top_items = [it for _, it in scored]
 
     try:
         preview = ", ".join(
             f'"{item.get("user_query")}" (sim={score:.2f})'
-            for score, item in scored[:top_k]
+            for score, item in scored
         )
         log("history", f"Similar examples for '{user_query}': {preview}")
     except Exception:
@@ -451,10 +1072,121 @@ def load_similar_examples(
 # SEMANTIC FAST-PATH FOR DIRECT CACHE ANSWERS
 # -------------------------------------------------------------------
 
+def _find_cached_answer_by_embedding(
+    user_query: str,
+    index_path: Path,
+    index: List[Dict[str, Any]],
+    min_similarity: float,
+) -> Optional[str]:
+    """
+    Nearest-neighbour lookup of `user_query` in the HNSW vector index.
+    Returns the stored FINAL_ANSWER if cosine similarity >= min_similarity.
+    """
+    vindex, keys = _get_vector_index(index_path)
+    if vindex is None or not keys:
+        return None
+
+    vec = _embed(user_query)
+    if vec is None:
+        return None
+
+    scores, rows = vindex.search(vec, 1)
+    row, sim = int(rows[0][0]), float(scores[0][0])
+    if row < 0 or sim < min_similarity:
+        return None
+
+    key = tuple(keys[row])
+    for item in index:
+        if (item.get("session_id"), item.get("turn_index")) != key:
+            continue
+        fa = item.get("final_answer")
+        if isinstance(fa, str) and fa.startswith("FINAL_ANSWER:"):
+            log("history", f"⚡ Embedding HIT (cos={sim:.2f}) for: {user_query}")
+            return fa
+        break
+
+    return None
+
+
+@dataclass
+class _ParaphraseChoices:
+    """
+    Normalized user queries of entries with a FINAL_ANSWER and the answers
+    at the same positions, ordered by query length (`lengths`, ascending)
+    so a lookup only scans the lengths that can reach the threshold.
+    """
+    stamp: Optional[Tuple[int, ...]]
+    queries: List[str] = field(default_factory=list)
+    answers: List[str] = field(default_factory=list)
+    lengths: List[int] = field(default_factory=list)
+    char_bits: List[int] = field(default_factory=list)  # see _char_bits
+
+    def window(self, query_len: int, min_similarity: float) -> Tuple[int, int]:
+        """
+        Slice of candidates whose length n allows ratio >= min_similarity:
+        2*min(L, n)/(L + n) >= t  <=>  L*t/(2-t) <= n <= L*(2-t)/t.
+        Widened by one on each side against float rounding.
+        """
+        t = min_similarity
+        if t <= 0:
+            return 0, len(self.lengths)
+        lo = bisect.bisect_left(self.lengths, query_len * t / (2 - t) - 1)
+        hi = bisect.bisect_right(self.lengths, query_len * (2 - t) / t + 1)
+        return lo, hi
+
+
+_PARAPHRASE_CACHE: Dict[Path, _ParaphraseChoices] = {}
+
+
+def _char_bits(text: str) -> int:
+    """
+    64-bit presence mask of the characters in `text` (code point mod 64).
+    Disjoint masks mean the strings share no character at all.
+    """
+    bits = 0
+    for c in set(text):
+        bits |= 1 << (ord(c) & 63)
+    return bits
+
+
+def _get_paraphrase_choices(index_path: Path, index: List[Dict[str, Any]]) -> _ParaphraseChoices:
+    """
+    Return the paraphrase candidates of `index`, rebuilt only when the
+    index file changed.
+    """
+    stamp = _index_stamp(index_path)
+    cached = _PARAPHRASE_CACHE.get(index_path)
+    if cached is not None and cached.stamp == stamp:
+        return cached
+
+    pairs: List[Tuple[str, str]] = []
+    for item in index:
+        uq = item.get("user_query")
+        fa = item.get("final_answer")
+
+        if not isinstance(uq, str) or not isinstance(fa, str):
+            continue
+        if not fa.startswith("FINAL_ANSWER:"):
+            continue
+        pairs.append((_normalize_for_similarity(uq), fa))
+
+    pairs.sort(key=lambda p: len(p[0]))  # stable: index order within a length
+    choices = _ParaphraseChoices(
+        stamp=stamp,
+        queries=[q for q, _ in pairs],
+        answers=[fa for _, fa in pairs],
+        lengths=[len(q) for q, _ in pairs],
+        char_bits=[_char_bits(q) for q, _ in pairs],
+    )
+    _PARAPHRASE_CACHE[index_path] = choices
+    return choices
+
+
 def find_best_cached_answer(
     user_query: str,
     min_similarity: float,
     memory_root: str = "memory",  # kept for signature compatibility, ignored
+    index_path: Optional[Path] = None,
 ) -> Optional[str]:
     """
     Returns the FULL `FINAL_ANSWER: ...` string if the user query
@@ -462,28 +1194,77 @@ def find_best_cached_answer(
 
     min_similarity is typically driven by profiles.yaml (read in loop.py).
     """
-    index_path = _get_index_path()
-    index = _load_index(index_path)
+    return find_best_cached_answer_ctx(QueryCtx.from_query(user_query), min_similarity, index_path=index_path)
+
+
+def find_best_cached_answer_ctx(
+    query: QueryCtx,
+    min_similarity: float,
+    index_path: Optional[Path] = None,
+) -> Optional[str]:
+    """
+    find_best_cached_answer for a prepared QueryCtx.
+    """
+    user_query = query.text
+    if index_path is None:
+        index_path = _get_index_path()
+    index = _load_index_cached(index_path)
 
     if not index:
         return None
 
+    # 1) ANN lookup over query embeddings (if enabled)
+    use_embeddings, emb_threshold = _get_embedding_settings()
+    if use_embeddings:
+        hit = _find_cached_answer_by_embedding(user_query, index_path, index, emb_threshold)
+        if hit:
+            return hit
+
+    # 2) Fallback: character-level similarity scan
+    # over the past queries whose length can reach min_similarity
+    choices = _get_paraphrase_choices(index_path, index)
+    query_norm = query.norm
+    lq = len(query_norm)
+    start, stop = choices.window(lq, min_similarity)
     best: Optional[str] = None
     best_sim = 0.0
 
-    for item in index:
-        uq = item.get("user_query")
-        fa = item.get("final_answer")
-
-        if not isinstance(uq, str) or not isinstance(fa, str):
+    if _rf_extract is not None:
+        # rapidfuzz's Indel ratio (2*LCS/len sum) is an upper bound of
+        # difflib's ratio, so one C-level pass drops every row that cannot
+        # reach min_similarity; the survivors are still scored by difflib.
+        # (the small slack absorbs float rounding of the two scales)
+        matches = _rf_extract(
+            query_norm,
+            choices.queries[start:stop],
+            scorer=_rf_ratio,
+            score_cutoff=max(min_similarity * 100 - 1e-6, 0),
+            limit=None,
+        )
+        rows = sorted(start + m[2] for m in matches)
+    else:
+        rows = range(start, stop)
+
+    # Cheap upper bounds first, SequenceMatcher.ratio() only for the rest
+    query_bits = query.bits
+    matcher = difflib.SequenceMatcher(None, query_norm)
+    for row in rows:
+        uq = choices.queries[row]
+        # exact length bound (the window is widened by one at each end)
+        lo, hi = sorted((lq, len(uq)))
+        if hi and 2.0 * lo / (lo + hi) < min_similarity:
             continue
-        if not fa.startswith("FINAL_ANSWER:"):
+        # no character in common: ratio is 0
+        if lo and not query_bits & choices.char_bits[row]:
             continue
-
-        sim = _string_similarity(user_query, uq)
+        matcher.set_seq2(uq)
+        # character-multiset bound, ratio() <= quick_ratio()
+        if matcher.quick_ratio() < min_similarity:
+            continue
+        sim = matcher.ratio()
         if sim > best_sim:
             best_sim = sim
-            best = fa
+            best = choices.answers[row]
 
     if best and best_sim >= min_similarity:
         log("history", f"⚡ Semantic HIT (sim={best_sim:.2f}) for: {user_query}")
@@ -0,0 +1,155 @@
+# modules/historical_store.py
+
+"""
+SQLite backend for the historical conversation index.
+
+Used by modules/historical_index.py when custom_config.memory_index_file
+points at a .db / .sqlite / .sqlite3 file. Rows are keyed by
+(session_id, turn_index), so a session update is an indexed INSERT instead
+of a read-modify-write of the whole JSON store, and WAL mode lets cache
+lookups read while an update is being written.
+"""
+
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib json fallback
+    orjson = None
+
+
+# Shared JSON codec of the historical index (also used by historical_index.py
+# for the JSON / JSONL stores and session memory files)
+def _json_loads(data: Any) -> Any:
+    """Decode JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj: Any, indent: bool = False) -> bytes:
+    """UTF-8 JSON bytes (non-ASCII kept as is), optionally 2-space indented."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode("utf-8")
+
+
+SQLITE_SUFFIXES = {".db", ".sqlite", ".sqlite3"}
+
+_LIST_FIELDS = ("tools_used", "successful_tools", "tags", "keywords")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    session_id       TEXT    NOT NULL,
+    turn_index       INTEGER NOT NULL,
+    user_query       TEXT    NOT NULL,
+    final_answer     TEXT    NOT NULL,
+    tools_used       TEXT    NOT NULL DEFAULT '[]',
+    successful_tools TEXT    NOT NULL DEFAULT '[]',
+    tags             TEXT    NOT NULL DEFAULT '[]',
+    keywords         TEXT    NOT NULL DEFAULT '[]',
+    ts               REAL    NOT NULL,
+    PRIMARY KEY (session_id, turn_index)
+)
+"""
+
+_COLUMNS = (
+    "session_id", "turn_index", "user_query", "final_answer",
+    "tools_used", "successful_tools", "tags", "keywords",
+)
+
+
+def is_sqlite_path(path: Path) -> bool:
+    return path.suffix.lower() in SQLITE_SUFFIXES
+
+
+@contextmanager
+def _connect(path: Path) -> Iterator[sqlite3.Connection]:
+    """
+    Open a short-lived autocommit connection (one per call, so it is safe
+    to use from the background index-update thread).
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+def _to_row(item: Dict[str, Any], ts: float) -> tuple:
+    return (
+        item.get("session_id"),
+        item.get("turn_index"),
+        item.get("user_query") or "",
+        item.get("final_answer") or "",
+        *(_json_dumps(item.get(f) or []).decode("utf-8") for f in _LIST_FIELDS),
+        ts,
+    )
+
+
+def _from_row(row: tuple) -> Dict[str, Any]:
+    item = dict(zip(_COLUMNS, row))
+    for f in _LIST_FIELDS:
+        item[f] = _json_loads(item[f])
+    return item
+
+
+def load_items(path: Path) -> List[Dict[str, Any]]:
+    """
+    Return all indexed examples in insertion order, shaped like the
+    entries of the JSON store.
+    """
+    if not path.exists():
+        return []
+    with _connect(path) as conn:
+        rows = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM conversations ORDER BY rowid"
+        ).fetchall()
+    return [_from_row(r) for r in rows]
+
+
+def insert_new_items(path: Path, items: List[Dict[str, Any]]) -> int:
+    """
+    Insert examples whose (session_id, turn_index) is not indexed yet.
+    Returns the number of rows actually added.
+    """
+    if not items:
+        return 0
+    ts = time.time()
+    placeholders = ", ".join("?" * (len(_COLUMNS) + 1))
+    with _connect(path) as conn:
+        before = conn.total_changes
+        conn.execute("BEGIN")
+        conn.executemany(
+            f"INSERT INTO conversations ({', '.join(_COLUMNS)}, ts) VALUES ({placeholders}) "
+            "ON CONFLICT(session_id, turn_index) DO NOTHING",
+            [_to_row(it, ts) for it in items],
+        )
+        conn.execute("COMMIT")
+        return conn.total_changes - before
+
+
+def replace_all_items(path: Path, items: List[Dict[str, Any]]) -> None:
+    """
+    Overwrite the whole table (used by _save_index for full rewrites).
+    """
+    ts = time.time()
+    placeholders = ", ".join("?" * (len(_COLUMNS) + 1))
+    with _connect(path) as conn:
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM conversations")
+        conn.executemany(
+            f"INSERT OR REPLACE INTO conversations ({', '.join(_COLUMNS)}, ts) VALUES ({placeholders})",
+            [_to_row(it, ts) for it in items],
+        )
+        conn.execute("COMMIT")
@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 import yaml
 import requests
 from pathlib import Path
@@ -27,11 +28,13 @@ class ModelManager:
             self.client = genai.Client(api_key=api_key)
 
     async def generate_text(self, prompt: str) -> str:
+        # Blocking HTTP clients: run in a worker thread so concurrent
+        # calls don't stall the event loop
         if self.model_type == "gemini":
-            return self._gemini_generate(prompt)
+            return await asyncio.to_thread(self._gemini_generate, prompt)
 
         elif self.model_type == "ollama":
-            return self._ollama_generate(prompt)
+            return await asyncio.to_thread(self._ollama_generate, prompt)
 
         raise NotImplementedError(f"Unsupported model type: {self.model_type}")
 
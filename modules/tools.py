@@ -1,6 +1,9 @@
 # modules/tools.py
 
-from typing import List, Dict, Optional, Any
+from collections import OrderedDict
+from typing import List, Dict, Optional, Any, Tuple
+import functools
+import os
 import re
 
 def extract_json_block(text: str) -> str:
@@ -10,15 +13,29 @@ def extract_json_block(text: str) -> str:
     return text.strip()
 
 
+# ((name, description), ...) -> rendered summary; evicted LRU-first
+_TOOL_SUMMARY_CACHE: "OrderedDict[Tuple[Tuple[str, str], ...], str]" = OrderedDict()
+_TOOL_SUMMARY_CACHE_MAX = 128
+
+
 def summarize_tools(tools: List[Any]) -> str:
     """
     Generate a string summary of tools for LLM prompt injection.
     Format: "- tool_name: description"
     """
-    return "\n".join(
-        f"- {tool.name}: {getattr(tool, 'description', 'No description provided.')}"
+    key = tuple(
+        (tool.name, getattr(tool, 'description', 'No description provided.'))
         for tool in tools
     )
+    summary = _TOOL_SUMMARY_CACHE.get(key)
+    if summary is not None:
+        _TOOL_SUMMARY_CACHE.move_to_end(key)
+        return summary
+    summary = "\n".join(f"- {name}: {description}" for name, description in key)
+    _TOOL_SUMMARY_CACHE[key] = summary
+    if len(_TOOL_SUMMARY_CACHE) > _TOOL_SUMMARY_CACHE_MAX:
+        _TOOL_SUMMARY_CACHE.popitem(last=False)
+    return summary
 
 
 def filter_tools_by_hint(tools: List[Any], hint: Optional[str] = None) -> List[Any]:
@@ -48,6 +65,15 @@ def tool_expects_input(self, tool_name: str) -> bool:
     return list(tool.parameters.keys()) == ['input']
 
 
-def load_prompt(path: str) -> str:
+@functools.lru_cache(maxsize=32)
+def _read_prompt(path: str, mtime_ns: int) -> str:
     with open(path, "r", encoding="utf-8") as f:
         return f.read()
+
+
+def load_prompt(path: str) -> str:
+    """
+    Prompt template text, cached by (path, mtime) so an edited template is
+    picked up on the next call.
+    """
+    return _read_prompt(path, os.stat(path).st_mtime_ns)
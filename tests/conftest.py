@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+# Importing the agent modules builds a Gemini client; no request is ever sent
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+
+def backend_fixture(module, attr):
+    """
+    Fixture running a test with the optional accelerator `module.<attr>`
+    ("accelerated", skipped if it is not installed) and without it
+    ("fallback", attr set to None).
+    """
+
+    @pytest.fixture(params=["accelerated", "fallback"])
+    def backend(request, monkeypatch):
+        if request.param == "fallback":
+            monkeypatch.setattr(module, attr, None)
+        elif getattr(module, attr) is None:
+            pytest.skip(f"{attr} not installed")
+        return request.param
+
+    return backend
+
+
+# Historical index entries with every field the stores keep
+INDEX_ITEMS = [
+    {
+        "session_id": "s1",
+        "turn_index": 0,
+        "user_query": "Wie spät ist es in Zürich?",
+        "final_answer": "FINAL_ANSWER: 14:00 — café time",
+        "tools_used": ["clock"],
+        "successful_tools": ["clock"],
+        "tags": ["time", "zürich"],
+        "keywords": ["wie", "spät", "zürich"],
+    },
+    {
+        "session_id": "s2",
+        "turn_index": 1,
+        "user_query": "sum of 1 and 2",
+        "final_answer": "FINAL_ANSWER: 3",
+        "tools_used": [],
+        "successful_tools": [],
+        "tags": [],
+        "keywords": ["sum", "1", "2"],
+    },
+]
@@ -0,0 +1,35 @@
+import asyncio
+import sys
+
+import pytest
+
+import agent
+
+
+@pytest.fixture
+def loop_type(monkeypatch):
+    """Run agent.run_agent() with a stub main() that records its event loop type."""
+    seen = []
+
+    async def main():
+        seen.append(type(asyncio.get_running_loop()))
+
+    monkeypatch.setattr(agent, "main", main)
+
+    def run():
+        agent.run_agent()
+        [loop_cls] = seen
+        return loop_cls
+
+    return run
+
+
+def test_runs_on_uvloop_when_installed(loop_type):
+    uvloop = pytest.importorskip("uvloop")
+    assert issubclass(loop_type(), uvloop.Loop)
+
+
+def test_falls_back_to_asyncio_without_uvloop(monkeypatch, loop_type):
+    monkeypatch.setitem(sys.modules, "uvloop", None)  # import raises ImportError
+    loop_cls = loop_type()
+    assert loop_cls.__module__.startswith("asyncio")
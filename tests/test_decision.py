@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+import pytest
+
+from modules import decision
+from modules.perception import PerceptionResult
+
+PLAN = "async def solve():\n    return 'FINAL_ANSWER: 42'"
+
+
+@pytest.fixture
+def planner(monkeypatch):
+    """generate_plan against a canned LLM reply, recording example lookups."""
+    lookups = []
+
+    async def generate_text(prompt):
+        return PLAN
+
+    monkeypatch.setattr(decision.model, "generate_text", generate_text)
+    monkeypatch.setattr(
+        decision, "load_similar_examples", lambda query: lookups.append(query) or []
+    )
+
+    def run(prompt_path, **kwargs):
+        return asyncio.run(
+            decision.generate_plan(
+                user_input="what is six times seven",
+                perception=PerceptionResult(intent="math"),
+                memory_items=[],
+                tool_descriptions="",
+                prompt_path=str(prompt_path),
+                **kwargs,
+            )
+        )
+
+    return run, lookups
+
+
+def test_examples_not_looked_up_without_placeholder(tmp_path, planner):
+    run, lookups = planner
+    prompt = tmp_path / "decision.txt"
+    prompt.write_text("Tools: {tool_descriptions}\nQuery: {user_input}\n")
+
+    assert run(prompt) == PLAN
+    assert lookups == []
+
+
+def test_examples_looked_up_with_placeholder(tmp_path, planner):
+    run, lookups = planner
+    prompt = tmp_path / "decision.txt"
+    prompt.write_text(
+        "Tools: {tool_descriptions}\nPast: {historical_examples}\nQuery: {user_input}\n"
+    )
+
+    assert run(prompt) == PLAN
+    assert lookups == ["what is six times seven"]
+
+
+def test_edited_prompt_template_is_reloaded(tmp_path):
+    prompt = tmp_path / "decision.txt"
+    prompt.write_text("v1 {user_input}")
+    assert decision._load_decision_prompt(str(prompt)) == ("v1 {user_input}", False, False)
+
+    prompt.write_text("v2 {historical_examples} {user_input}")
+    st = prompt.stat()
+    # force a distinct mtime even on coarse-grained filesystems
+    os.utime(prompt, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert decision._load_decision_prompt(str(prompt)) == (
+        "v2 {historical_examples} {user_input}",
+        False,
+        True,
+    )
+
+
+@pytest.mark.parametrize("verbose", [False, True])
+def test_prompt_snippet_logged_only_when_verbose(tmp_path, monkeypatch, planner, verbose):
+    run, _ = planner
+    logged = []
+    monkeypatch.setattr(decision, "log", lambda stage, msg: logged.append(msg))
+    prompt = tmp_path / "decision.txt"
+    prompt.write_text("Query: {user_input}\n")
+
+    run(prompt, verbose=verbose)
+    assert any(m.startswith("Prompt snippet:") for m in logged) == verbose
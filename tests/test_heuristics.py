@@ -0,0 +1,61 @@
+import pytest
+
+from conftest import backend_fixture
+from modules import heuristics
+
+DOMAIN_REPLY = "FINAL_ANSWER: For privacy reasons I can’t access that site. Please paste the relevant text instead."
+HARMFUL_REPLY = "FINAL_ANSWER: I can’t help with harmful or unsafe scripts."
+SECRET_REPLY = "FINAL_ANSWER: This looks confidential. Please remove secrets and try again."
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        # the secret match "password" overlaps the domain "drive.google.com"
+        ("send passwordrive.google.com now", DOMAIN_REPLY),
+        ("please run rm -rf on localhost", DOMAIN_REPLY),
+        ("my password for powershell please", HARMFUL_REPLY),
+        ("what is the secret key here", SECRET_REPLY),
+        ("upload it to Drive.Google.com please", None),
+        ("what is the capital of france", None),
+    ],
+)
+def test_query_heuristics_rule_priority(query, expected):
+    result = heuristics.apply_query_heuristics(query)
+    if expected is None:
+        assert result.allowed
+        assert result.text == query
+    else:
+        assert not result.allowed
+        assert result.text == expected
+
+
+# Aho-Corasick automaton vs the regex fallback
+masking_backend = backend_fixture(heuristics, "_BANNED_AUTOMATON")
+
+
+@pytest.mark.parametrize(
+    "answer, expected",
+    [
+        ("FINAL_ANSWER: clean", "FINAL_ANSWER: clean"),
+        ("FINAL_ANSWER: BadWord1 and xbadword2x", "FINAL_ANSWER: ******** and x********x"),
+        ("badword1badword2", "****************"),
+        # lower() changes the length here, so offsets cannot be reused
+        ("İ badword1", "İ ********"),
+    ],
+)
+def test_banned_words_are_masked(masking_backend, answer, expected):
+    assert heuristics.apply_answer_heuristics(answer) == expected
+
+
+def test_long_answer_masks_the_kept_head(masking_backend):
+    answer = "x" * 996 + "badword1" + "y" * 4000
+    result = heuristics.apply_answer_heuristics(answer)
+    assert result == "FURTHER_PROCESSING_REQUIRED: " + "x" * 996 + "****..."
+
+
+def test_long_answer_keeps_1000_chars_without_banned_words(monkeypatch):
+    monkeypatch.setattr(heuristics, "_BANNED_FOLDED", ())
+    monkeypatch.setattr(heuristics, "_BANNED_MAX_LEN", 0)
+    result = heuristics.apply_answer_heuristics("x" * 5000)
+    assert result == "FURTHER_PROCESSING_REQUIRED: " + "x" * 1000 + "..."
@@ -0,0 +1,159 @@
+import difflib
+import json
+import random
+
+import pytest
+
+from conftest import INDEX_ITEMS, backend_fixture
+from modules import historical_index as hi
+from modules import historical_store
+
+# Unrelated queries that rapidfuzz's Indel ratio scores well above
+# difflib's ratio (the scorer the cache-hit thresholds are tuned for)
+NEAR_MISSES = [
+    ("w250 w135 w1 w233", "w50 w151 w91 w33"),
+    ("convert 250 usd to eur", "convert 520 eur to usd"),
+    ("convert usd sum 125 125", "convert usd usd 250 125"),
+    ("how many r in strawberry", "how many s in mississippi"),
+]
+
+DEFAULT_THRESHOLD = 0.80  # AgentLoop's jaccard_similarity_threshold default
+
+
+@pytest.mark.parametrize("a, b", NEAR_MISSES)
+def test_string_similarity_is_difflib_ratio(a, b):
+    expected = difflib.SequenceMatcher(
+        None, hi._normalize_for_similarity(a), hi._normalize_for_similarity(b)
+    ).ratio()
+    assert hi._string_similarity(a, b) == expected
+
+
+def test_near_miss_stays_below_default_threshold():
+    assert hi._string_similarity(*NEAR_MISSES[0]) < DEFAULT_THRESHOLD
+
+
+def _write_index(path, queries):
+    hi._save_index(
+        path,
+        [
+            {
+                "session_id": f"s{i}",
+                "turn_index": 0,
+                "user_query": q,
+                "final_answer": f"FINAL_ANSWER: answer {i}",
+            }
+            for i, q in enumerate(queries)
+        ],
+    )
+
+
+def _reference_best(queries, user_query, min_similarity):
+    """Plain difflib scan: first entry with the highest ratio."""
+    best, best_sim = None, 0.0
+    for i, q in enumerate(queries):
+        sim = hi._string_similarity(user_query, q)
+        if sim > best_sim:
+            best, best_sim = f"FINAL_ANSWER: answer {i}", sim
+    return best if best and best_sim >= min_similarity else None
+
+
+# rapidfuzz prefilter vs difflib on every candidate
+scorer_backend = backend_fixture(hi, "_rf_extract")
+
+
+@pytest.mark.parametrize("stored, query", NEAR_MISSES)
+def test_near_miss_is_not_a_cache_hit(tmp_path, scorer_backend, stored, query):
+    index_path = tmp_path / "store.jsonl"
+    _write_index(index_path, [stored])
+    assert hi.find_best_cached_answer(query, DEFAULT_THRESHOLD, index_path=index_path) is None
+
+
+def test_paraphrase_is_a_cache_hit(tmp_path, scorer_backend):
+    index_path = tmp_path / "store.jsonl"
+    _write_index(index_path, ["What is the capital of France?"])
+    assert (
+        hi.find_best_cached_answer("what is the capital of  france", DEFAULT_THRESHOLD, index_path=index_path)
+        == "FINAL_ANSWER: answer 0"
+    )
+
+
+def test_cached_answer_matches_plain_difflib_scan(tmp_path, scorer_backend):
+    rng = random.Random(7)
+    words = "what is the capital of france germany how many r in strawberry spell w1 w50".split()
+    queries = [" ".join(rng.choices(words, k=rng.randint(1, 8))) for _ in range(200)]
+    index_path = tmp_path / "store.jsonl"
+    _write_index(index_path, queries)
+
+    for _ in range(200):
+        user_query = " ".join(rng.choices(words, k=rng.randint(1, 8)))
+        threshold = rng.choice([0.5, 0.7, 0.8, 0.9])
+        # Ties between different lengths may resolve to another row with the
+        # same score, so compare the score of the returned answer
+        got = hi.find_best_cached_answer(user_query, threshold, index_path=index_path)
+        expected = _reference_best(queries, user_query, threshold)
+        if expected is None:
+            assert got is None
+        else:
+            got_query = queries[int(got.rsplit(" ", 1)[1])]
+            exp_query = queries[int(expected.rsplit(" ", 1)[1])]
+            assert hi._string_similarity(user_query, got_query) == hi._string_similarity(user_query, exp_query)
+
+
+# -------------------------------------------------------------------
+# Optional accelerators: each one must match its fallback
+# -------------------------------------------------------------------
+
+json_backend = backend_fixture(historical_store, "orjson")
+ijson_backend = backend_fixture(hi, "ijson")
+numpy_backend = backend_fixture(hi, "np")
+
+
+@pytest.mark.parametrize("suffix", [".jsonl", ".json"])
+def test_index_round_trip(tmp_path, json_backend, suffix):
+    index_path = tmp_path / f"store{suffix}"
+    hi._save_index(index_path, INDEX_ITEMS)
+    assert hi._load_index(index_path) == INDEX_ITEMS
+    # both codecs write UTF-8 as is, not \u escapes
+    assert "Zürich" in index_path.read_text(encoding="utf-8")
+
+
+def test_jsonl_append(tmp_path, json_backend):
+    index_path = tmp_path / "store.jsonl"
+    hi._save_index(index_path, INDEX_ITEMS[:1])
+    hi._append_index(index_path, INDEX_ITEMS[1:])
+    assert hi._load_index(index_path) == INDEX_ITEMS
+
+
+def test_parse_session_memory(tmp_path, ijson_backend):
+    events = [
+        {"type": "run_metadata", "text": "Started new session with input: sum of 1 and 2 at 2025-11-28T20:07:31"},
+        {"type": "tool_output", "tool_name": "add", "success": True, "tags": ["math"]},
+        {"type": "tool_output", "tool_name": "solve_sandbox", "final_answer": "FINAL_ANSWER: 3"},
+        {"type": "run_metadata", "text": "Started new session with input: what is unknowable at 2025-11-28T20:08:00"},
+        {"type": "tool_output", "tool_name": "solve_sandbox", "final_answer": "FINAL_ANSWER: unknown"},
+    ]
+    memory_path = tmp_path / "session.json"
+    memory_path.write_text(json.dumps(events), encoding="utf-8")
+
+    [example] = hi._parse_session_memory(memory_path, "s1")
+    assert example.user_query == "sum of 1 and 2"
+    assert example.final_answer == "FINAL_ANSWER: 3"
+    assert example.tools_used == ["add", "solve_sandbox"]
+    assert example.successful_tools == ["add"]
+    assert example.tags == ["math"]
+
+
+def test_keyword_ranking_matches_pure_python(tmp_path, monkeypatch, numpy_backend):
+    rng = random.Random(7)
+    words = [f"w{i}" for i in range(40)]
+    queries = [" ".join(rng.sample(words, rng.randint(2, 6))) for _ in range(300)]
+    index_path = tmp_path / "store.jsonl"
+    _write_index(index_path, queries)
+    monkeypatch.setattr(hi, "_VECTORIZE_MIN_ROWS", 0)
+
+    kidx = hi._get_keyword_index(index_path)
+    for _ in range(50):
+        query = hi.QueryCtx.from_query(" ".join(rng.sample(words, rng.randint(1, 5))))
+        expected = hi._rank_by_keywords(kidx, query.keywords, 3)
+        got = hi.load_similar_examples_ctx(query, top_k=3, index_path=index_path)
+        assert got == [item for _, item in expected]
@@ -0,0 +1,28 @@
+import pytest
+
+from conftest import INDEX_ITEMS, backend_fixture
+from modules import historical_store as hs
+
+json_backend = backend_fixture(hs, "orjson")
+
+
+def test_round_trip(tmp_path, json_backend):
+    path = tmp_path / "store.db"
+    hs.replace_all_items(path, INDEX_ITEMS)
+    assert hs.load_items(path) == INDEX_ITEMS
+
+
+def test_insert_skips_indexed_keys(tmp_path, json_backend):
+    path = tmp_path / "store.db"
+    assert hs.insert_new_items(path, INDEX_ITEMS[:1]) == 1
+    assert hs.insert_new_items(path, INDEX_ITEMS) == 1
+    assert hs.load_items(path) == INDEX_ITEMS
+
+
+def test_list_columns_readable_by_either_codec(tmp_path, monkeypatch):
+    if hs.orjson is None:
+        pytest.skip("orjson not installed")
+    path = tmp_path / "store.db"
+    hs.replace_all_items(path, INDEX_ITEMS)
+    monkeypatch.setattr(hs, "orjson", None)
+    assert hs.load_items(path) == INDEX_ITEMS
@@ -0,0 +1,38 @@
+import asyncio
+from types import SimpleNamespace
+
+from core import loop
+
+
+def _agent(tmp_path, session_id, user_input):
+    context = SimpleNamespace(
+        dispatcher=None,
+        agent_profile=SimpleNamespace(
+            custom_config=SimpleNamespace(memory_index_file=str(tmp_path / "store.jsonl"))
+        ),
+        user_input=user_input,
+        memory=SimpleNamespace(session_id=session_id, memory_path=str(tmp_path / f"{session_id}.json")),
+    )
+    return loop.AgentLoop(context)
+
+
+def test_previous_run_is_indexed_before_the_cache_lookup(tmp_path, monkeypatch):
+    indexed = []
+    monkeypatch.setattr(
+        loop,
+        "update_index_for_sessions",
+        lambda pairs, index_path: indexed.extend(sid for _, sid in pairs),
+    )
+
+    def find_best_cached_answer_ctx(query, min_similarity, index_path):
+        return "FINAL_ANSWER: 42" if "s1" in indexed else None
+
+    monkeypatch.setattr(loop, "find_best_cached_answer_ctx", find_best_cached_answer_ctx)
+
+    async def scenario():
+        first = _agent(tmp_path, "s1", "what is six times seven")
+        first._update_historical_index()
+        # no await in between, like agent.py's blocking input()
+        return await _agent(tmp_path, "s2", "what is six times seven").run()
+
+    assert asyncio.run(scenario()) == {"status": "done", "result": "FINAL_ANSWER: 42"}
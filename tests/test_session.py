@@ -0,0 +1,56 @@
+import asyncio
+import os
+import signal
+import textwrap
+
+import pytest
+
+from core.session import ServerConnection
+
+SERVER = textwrap.dedent(
+    """
+    import os
+    from mcp.server.fastmcp import FastMCP
+
+    mcp = FastMCP("pid")
+
+    @mcp.tool()
+    def pid() -> str:
+        return str(os.getpid())
+
+    if __name__ == "__main__":
+        mcp.run(transport="stdio")
+    """
+)
+
+
+async def _server_pid(conn: ServerConnection) -> int:
+    result = await asyncio.wait_for(conn.call_tool("pid", {}), timeout=30)
+    return int(result.content[0].text)
+
+
+def test_dead_server_is_restarted_on_next_call(tmp_path):
+    script = tmp_path / "pid_server.py"
+    script.write_text(SERVER)
+
+    async def scenario():
+        conn = ServerConnection({"script": str(script), "cwd": str(tmp_path)}, idle_timeout=300)
+        try:
+            first = await _server_pid(conn)
+            assert await _server_pid(conn) == first  # session is reused
+
+            os.kill(first, signal.SIGKILL)
+            await asyncio.sleep(0.5)
+
+            # The call that hits the dead transport may fail ...
+            try:
+                second = await _server_pid(conn)
+            except Exception:
+                second = await _server_pid(conn)
+            # ... but the connection recovers with a fresh server process
+            assert second != first
+            assert await _server_pid(conn) == second
+        finally:
+            await conn.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,29 @@
+import os
+from types import SimpleNamespace
+
+from modules import tools
+
+
+def test_edited_prompt_is_reloaded(tmp_path):
+    prompt = tmp_path / "perception.txt"
+    prompt.write_text("v1")
+    assert tools.load_prompt(str(prompt)) == "v1"
+
+    prompt.write_text("v2")
+    st = prompt.stat()
+    # force a distinct mtime even on coarse-grained filesystems
+    os.utime(prompt, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert tools.load_prompt(str(prompt)) == "v2"
+
+
+def test_tool_summary_follows_description_changes():
+    old = [SimpleNamespace(name="add", description="Add two numbers")]
+    new = [SimpleNamespace(name="add", description="Add two integers")]
+    assert tools.summarize_tools(old) == "- add: Add two numbers"
+    assert tools.summarize_tools(new) == "- add: Add two integers"
+
+
+def test_tool_summary_cache_is_bounded():
+    for i in range(tools._TOOL_SUMMARY_CACHE_MAX + 10):
+        tools.summarize_tools([SimpleNamespace(name=f"t{i}", description="d")])
+    assert len(tools._TOOL_SUMMARY_CACHE) == tools._TOOL_SUMMARY_CACHE_MAX